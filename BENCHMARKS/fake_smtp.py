@@ -0,0 +1,63 @@
+import socketserver
+import threading
+import time
+
+# a tiny stand-in SMTP server that accepts everything, for testing the mailer without gmail
+# python BENCHMARKS/fake_smtp.py then set smtp_host=127.0.0.1 smtp_port=2525 smtp_starttls=0
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.reply("220 fake smtp ready")
+        in_data = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            text = line.decode("utf-8", "replace").rstrip("\r\n")
+            if in_data:
+                if text == ".":
+                    in_data = False
+                    if self.server.delay:
+                        time.sleep(self.server.delay) # pretend to be a slow real server
+                    with self.server.lock:
+                        self.server.received += 1
+                    self.reply("250 OK queued")
+                continue
+            command = text[:4].upper()
+            if command in ("EHLO", "HELO"):
+                self.reply("250 fake")
+            elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "DATA":
+                in_data = True
+                self.reply("354 end with .")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class FakeSMTP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=2525, delay=0.0):
+        super().__init__((host, port), Handler)
+        self.delay = delay # seconds per message
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == '__main__':
+    server = FakeSMTP()
+    print(f"Fake SMTP on {server.server_address[0]}:{server.server_address[1]}")
+    server.serve_forever()
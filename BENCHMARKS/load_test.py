@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import tempfile
+import argparse
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# replays a mix of pupil, teacher and admin traffic against the app and reports latency per route
+# python BENCHMARKS/load_test.py --requests 3000 --users 16                  (Flask test client on a copy of DB.db)
+# python BENCHMARKS/load_test.py --url http://127.0.0.1:8000 --requests 3000 (a running server, e.g. gunicorn)
+# python BENCHMARKS/load_test.py --compare BENCHMARKS/results/old.json      (prints the change against an earlier run)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RESULTS = os.path.join(ROOT, "BENCHMARKS", "results")
+SECRET_KEY = 'user_id' # main.app.secret_key, needed to make session cookies for --url
+
+# name -> (weight, role), the weights are roughly what a school day looks like
+SCENARIOS = {
+    "GET /studentPage": (30, 0),
+    "POST /check_location": (15, 0),
+    "POST /check_location/batch": (20, 0),
+    "GET /sub/teacherTiles": (15, 1),
+    "GET /sub/teacherList": (10, 1),
+    "GET /sub/adminViewAccounts": (5, 2),
+}
+
+SCHOOL = (-1.2690, 51.7765, -1.2665, 51.7785) # lon/lat box around the main buildings
+HOME = (-1.2356, 51.8229, -1.2344, 51.8234)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)] if values else 0.0
+
+def commit_hash():
+    try:
+        head = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True).stdout.strip())
+        return head, dirty
+    except OSError:
+        return None, None
+
+
+class Data:
+    # ids and filter values read straight from the db so both modes pick the same kind of requests
+    def __init__(self, path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        self.users = {role: [row[0] for row in conn.execute("SELECT UserID FROM ACCOUNTS WHERE RoleID = ?", (role,))] for role in (0, 1, 2)}
+        self.users[0] = [row[0] for row in conn.execute("SELECT UserID FROM ACCOUNTS WHERE RoleID = 0 AND UserID IN (SELECT UserID FROM STUDENT_INFO)")]
+        self.houses = [row[0] for row in conn.execute("SELECT DISTINCT House FROM STUDENT_INFO")]
+        self.forms = [row[0] for row in conn.execute("SELECT DISTINCT Form FROM STUDENT_INFO")]
+        self.rooms = [row[0] for row in conn.execute("SELECT LocationName FROM LOCATIONS")]
+        conn.close()
+
+def fix(rng):
+    box = HOME if rng.random() < 0.1 else SCHOOL
+    return {"o": rng.uniform(box[0], box[2]), "a": rng.uniform(box[1], box[3])}
+
+def make_request(name, rng, data):
+    # (method, path, json body)
+    if name == "GET /studentPage":
+        return "GET", "/studentPage", None
+    if name == "POST /check_location":
+        return "POST", "/check_location", fix(rng)
+    if name == "POST /check_location/batch":
+        return "POST", "/check_location/batch", {"fixes": [fix(rng) for _ in range(rng.randint(5, 15))]}
+    if name == "GET /sub/teacherTiles":
+        args = [("limit", "50")]
+        if rng.random() < 0.3:
+            args.append(("SearchName", rng.choice("abcdefghijklmnoprstw")))
+        if rng.random() < 0.3:
+            args += [("house", house) for house in rng.sample(data.houses, min(2, len(data.houses)))]
+        if rng.random() < 0.3:
+            args.append(("form", rng.choice(data.forms)))
+        if rng.random() < 0.2:
+            args.append(("SearchRoom", rng.choice(data.rooms).split()[0]))
+        return "GET", "/sub/teacherTiles?" + urllib.parse.urlencode(args), None
+    if name == "GET /sub/teacherList":
+        return "GET", "/sub/teacherList", None
+    if name == "GET /sub/adminViewAccounts":
+        return "GET", "/sub/adminViewAccounts", None
+    raise ValueError(name)
+
+
+class TestClientTarget:
+    # imports main in a temp folder holding a copy of DB.db, so the real one is never written to
+    def __init__(self, db, slot):
+        self.folder = tempfile.mkdtemp()
+        shutil.copy(db, os.path.join(self.folder, "DB.db"))
+        os.symlink(os.path.join(ROOT, "WEBPAGE"), os.path.join(self.folder, "WEBPAGE"))
+        os.chdir(self.folder)
+        sys.path.insert(0, os.path.join(ROOT, "WEBPAGE"))
+        import logging
+        import app_logging
+        app_logging.setup()
+        for handler in app_logging._listener.handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setStream(open(os.devnull, "w")) # the console would be the bottleneck
+        import main
+        import presence
+        if slot:
+            d, t, w = slot.split()
+            presence.now_slot = lambda: (int(d), t, int(w)) # so teacher pages have a lesson to show on any day
+        self.app = main.app
+        self.db = os.path.join(self.folder, "DB.db")
+
+    def client(self, user_id):
+        client = self.app.test_client()
+        with client.session_transaction() as s:
+            s['user_id'] = user_id
+        def send(method, path, body):
+            response = client.open(path, method=method, json=body)
+            response.close()
+            return response.status_code
+        return send
+
+    def close(self):
+        os.chdir(ROOT)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+class UrlTarget:
+    # a server that is already running, logged in by signing our own session cookie
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        from flask import Flask
+        from flask.sessions import SecureCookieSessionInterface
+        app = Flask("load_test")
+        app.secret_key = SECRET_KEY
+        self.serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+
+    def client(self, user_id):
+        cookie = "session=" + self.serializer.dumps({"user_id": user_id})
+        opener = urllib.request.build_opener(NoRedirect())
+        def send(method, path, body):
+            headers = {"Cookie": cookie}
+            data = None
+            if body is not None:
+                data = json.dumps(body).encode()
+                headers["Content-Type"] = "application/json"
+            request = urllib.request.Request(self.url + path, data=data, headers=headers, method=method)
+            try:
+                with opener.open(request, timeout=30) as response:
+                    response.read()
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+        return send
+
+    def close(self):
+        pass
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None # a redirect counts as the answer, same as the test client
+
+
+def run(target, data, args):
+    names = list(SCENARIOS)
+    weights = [SCENARIOS[name][0] for name in names]
+    results = {name: [] for name in names} # name -> [(seconds, status)]
+    lock = threading.Lock()
+    counter = iter(range(args.warmup + args.requests))
+    started = {}
+
+    def user(number):
+        rng = random.Random(args.seed * 1000 + number)
+        clients = {role: target.client(rng.choice(data.users[role])) for role in (0, 1, 2) if data.users[role]}
+        while True:
+            with lock:
+                i = next(counter, None)
+                if i == args.warmup:
+                    started["at"] = time.perf_counter()
+            if i is None:
+                return
+            name = rng.choices(names, weights)[0]
+            method, path, body = make_request(name, rng, data)
+            start = time.perf_counter()
+            try:
+                status = clients[SCENARIOS[name][1]](method, path, body)
+            except Exception:
+                status = 0 # connection error
+            seconds = time.perf_counter() - start
+            if i >= args.warmup:
+                with lock:
+                    results[name].append((seconds, status))
+
+    with ThreadPoolExecutor(args.users) as pool:
+        list(pool.map(user, range(args.users)))
+    elapsed = time.perf_counter() - started.get("at", time.perf_counter())
+    return results, elapsed
+
+def summarise(samples, elapsed):
+    times = [seconds for seconds, status in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for seconds, status in samples if status == 0 or status >= 500),
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(times) / len(times) * 1000 if times else 0.0,
+        "p50_ms": percentile(times, 50) * 1000,
+        "p95_ms": percentile(times, 95) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "max_ms": max(times) * 1000 if times else 0.0,
+    }
+
+def print_table(report, previous=None):
+    print(f"{'route':<30}{'reqs':>7}{'err':>5}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(report["routes"].items()) + [("total", report["total"])]
+    for name, row in rows:
+        line = f"{name:<30}{row['requests']:>7}{row['errors']:>5}{row['throughput']:>9.1f}{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}"
+        old = previous and (previous["total"] if name == "total" else previous["routes"].get(name))
+        if old and old["p95_ms"]:
+            line += f"   p95 {(row['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100:+.0f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--warmup", type=int, default=200, help="requests before timing starts")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--db", default=os.path.join(ROOT, "DB.db"))
+    parser.add_argument("--url", help="load test a running server instead of the test client")
+    parser.add_argument("--slot", default="0 10:00 1", help="'day time week' presence uses in test client mode, empty for the real clock")
+    parser.add_argument("--output", help="JSON file, defaults to BENCHMARKS/results/<commit>-<time>.json")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    data = Data(args.db)
+    target = UrlTarget(args.url) if args.url else TestClientTarget(args.db, args.slot)
+    try:
+        results, elapsed = run(target, data, args)
+    finally:
+        target.close()
+
+    head, dirty = commit_hash()
+    report = {
+        "commit": head,
+        "dirty": dirty,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "target": args.url or "test client",
+        "settings": {"requests": args.requests, "warmup": args.warmup, "users": args.users, "seed": args.seed, "slot": args.slot},
+        "elapsed": elapsed,
+        "routes": {name: summarise(samples, elapsed) for name, samples in results.items()},
+        "total": summarise([sample for samples in results.values() for sample in samples], elapsed),
+    }
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"compared with {previous.get('commit', '?')[:10]} from {previous.get('time')}")
+    print_table(report, previous)
+
+    output = args.output or os.path.join(RESULTS, f"{(head or 'unknown')[:10]}{'-dirty' if dirty else ''}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import shutil
+import logging
+import tempfile
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+# request latency with logging off, with the old synchronous file handler and with the queued JSON logging
+# python BENCHMARKS/logging_latency.py --requests 2000 --threads 8
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "WEBPAGE"))
+
+ROUTES = [
+    ("GET", "/studentPage", None), # about 6 INFO lines
+    ("POST", "/check_location", {"a": 51.7777, "o": -1.2681}), # sampled 1 in 20
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+def run(main, user_id, requests, threads):
+    def one(i):
+        method, url, body = ROUTES[i % len(ROUTES)]
+        client = main.app.test_client()
+        with client.session_transaction() as s:
+            s['user_id'] = user_id
+        start = time.perf_counter()
+        if method == "GET":
+            client.get(url)
+        else:
+            client.post(url, json=body)
+        return time.perf_counter() - start
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(one, range(requests)))
+
+def use_sync_handlers(logger, devnull):
+    # the logging setup from before app_logging, written straight from the request thread
+    import app_logging
+    app_logging.stop()
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    for handler in (logging.FileHandler('app.log'), logging.StreamHandler(devnull)):
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--mode", choices=["off", "sync", "queued"], action="append",
+                        help="run one mode per process so they dont share warm caches, default runs all three")
+    args = parser.parse_args()
+    modes = args.mode or ["off", "sync", "queued"]
+    if len(modes) > 1:
+        for mode in modes: # fresh process each so one setup cant leak into the next
+            os.system(f'"{sys.executable}" "{os.path.abspath(__file__)}" --requests {args.requests} --threads {args.threads} --mode {mode}')
+        return
+    mode = modes[0]
+
+    folder = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "DB.db"), os.path.join(folder, "DB.db"))
+    os.symlink(os.path.join(ROOT, "WEBPAGE"), os.path.join(folder, "WEBPAGE"))
+    os.chdir(folder)
+    devnull = open(os.devnull, "w")
+
+    import app_logging
+    logger = app_logging.setup()
+    for handler in app_logging._listener.handlers:
+        if type(handler) is logging.StreamHandler:
+            handler.setStream(devnull) # console output would swamp the timings
+    import main
+    import DB_interface
+    user_id = DB_interface.get_data("SELECT UserID FROM ACCOUNTS WHERE RoleID = 0 AND UserID IN (SELECT UserID FROM STUDENT_INFO) LIMIT 1")[0][0]
+
+    if mode == "off":
+        logger.disabled = True
+    elif mode == "sync":
+        use_sync_handlers(logger, devnull)
+
+    run(main, user_id, min(200, args.requests), args.threads) # warm up caches and the pool
+    times = run(main, user_id, args.requests, args.threads)
+    app_logging.stop()
+    lines = sum(1 for _ in open("app.log", encoding="utf-8")) if os.path.exists("app.log") else 0
+
+    print(f"{mode:>7}: p50 {percentile(times, 50) * 1000:6.2f}ms  p95 {percentile(times, 95) * 1000:6.2f}ms  "
+          f"p99 {percentile(times, 99) * 1000:6.2f}ms  mean {statistics.mean(times) * 1000:6.2f}ms  "
+          f"({lines} log lines, {args.requests} requests, {args.threads} threads)")
+    devnull.close()
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "WEBPAGE"))
+import DB_interface
+import migrations
+import mailer
+from fake_smtp import FakeSMTP
+
+# how many emails per second the OUTBOX workers get through against the fake SMTP server
+# python BENCHMARKS/mail_outbox.py --emails 500 --delay 0.02
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds the fake server takes per email")
+    parser.add_argument("--workers", type=int, default=mailer.WORKERS)
+    parser.add_argument("--rate", type=float, default=1000, help="rate limit, emails per second")
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    DB_interface.db = os.path.join(folder, "bench.db")
+    migrations.run_migrations()
+
+    server = FakeSMTP(port=0, delay=args.delay).start()
+    os.environ["smtp_host"] = "127.0.0.1"
+    os.environ["smtp_port"] = str(server.server_address[1])
+    os.environ["smtp_starttls"] = "0"
+    mailer.WORKERS = args.workers
+    mailer._limiter = mailer.RateLimiter(args.rate)
+
+    start = time.perf_counter()
+    mailer.queue_emails(
+        [f"pupil{i}@school.co.uk" for i in range(args.emails)],
+        "Benchmark",
+        [f"message {i}" for i in range(args.emails)],
+    )
+    queued = time.perf_counter() - start
+    while mailer.outbox_counts().get("sent", 0) < args.emails:
+        time.sleep(0.05)
+    total = time.perf_counter() - start
+
+    print(f"queued {args.emails} emails in {queued * 1000:.1f}ms (what the request waits for)")
+    print(f"sent {server.received} in {total:.2f}s = {args.emails / total:.1f} emails/s "
+          f"with {args.workers} workers, {args.delay * 1000:.0f}ms per email on the server")
+    print(f"one connection in series would take about {args.emails * args.delay:.2f}s")
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import os
+import sys
+import math
+import time
+import random
+import shutil
+import sqlite3
+import logging
+import tempfile
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "WEBPAGE"))
+import synthetic_school
+
+# times the hot functions on made up schools of different sizes and prints how each one scales
+# python BENCHMARKS/micro.py --sizes 500 5000 50000
+
+ROUNDS = 5 # timed rounds per benchmark, the median is reported
+TARGET = 0.2 # seconds each round should roughly take
+
+
+def per_call(fn, rng):
+    # seconds per call, calls per round picked so a round takes about TARGET
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn(rng)
+        took = time.perf_counter() - start
+        if took >= TARGET / 10 or calls >= 100000:
+            break
+        calls *= 4
+    calls = max(1, round(calls * TARGET / max(took, 1e-9)))
+    rounds = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn(rng)
+        rounds.append((time.perf_counter() - start) / calls)
+    return statistics.median(rounds)
+
+
+def benchmarks(main, DB_interface, enc, presence, pupils):
+    ids = list(synthetic_school.pupil_ids(pupils))
+    rooms = [row[0] for row in DB_interface.get_data("SELECT LocationName FROM LOCATIONS")]
+    sample = {user_id: (main.get_time_table(user_id), main.get_alteration(user_id)) for user_id in ids[:200]}
+    merged = {user_id: main.merge_timetable(*sample[user_id]) for user_id in sample}
+    school = main.zone["Maths"].bounds
+
+    def point(rng):
+        return rng.uniform(school[0] - 0.002, school[2] + 0.002), rng.uniform(school[1] - 0.002, school[3] + 0.002)
+
+    def connect_per_call(rng):
+        # what every DB_interface call used to do
+        conn = sqlite3.connect(DB_interface.db)
+        conn.execute("SELECT RoleID FROM ACCOUNTS WHERE UserID = ?", (rng.choice(ids),)).fetchall()
+        conn.close()
+
+    return {
+        "build_combined_timetable (db + merge)": lambda rng: main.build_combined_timetable(rng.choice(ids)),
+        "merge_timetable (merge + sort)": lambda rng: main.merge_timetable(*sample[rng.choice(ids[:200])]),
+        "get_combined_timetable (cached)": lambda rng: main.get_combined_timetable(rng.choice(ids[:200])),
+        "current_lesson (studentPage scan)": lambda rng: main.current_lesson(merged[rng.choice(ids[:200])], rng.randint(0, 4), rng.choice(synthetic_school.PERIODS)[0], rng.randint(1, 2)),
+        "geofence.locate (one fix)": lambda rng: main.geofence.locate(*point(rng)),
+        "geofence.classify (100 fixes)": lambda rng: main.geofence.classify([point(rng) for _ in range(100)]),
+        "update_current_location": lambda rng: main.update_current_location(rng.choice(ids), rng.choice(rooms), "1"),
+        "presence.refresh_expected (whole school)": lambda rng: presence.refresh_expected("bench", 0, "08:35", 1),
+        "hash_password": lambda rng: enc.hash_password(f"password{rng.randint(0, 10 ** 6)}"),
+        "get_data (pooled)": lambda rng: DB_interface.get_data("SELECT RoleID FROM ACCOUNTS WHERE UserID = ?", (rng.choice(ids),)),
+        "sqlite3 connect per call": connect_per_call,
+    }
+
+def growth(sizes, times):
+    # exponent k in time ~ size^k between the smallest and largest school
+    if len(sizes) < 2 or not times[0] or not times[-1]:
+        return ""
+    k = math.log(times[-1] / times[0]) / math.log(sizes[-1] / sizes[0])
+    if k < 0.2:
+        return f"constant (n^{k:.2f})"
+    if k < 0.8:
+        return f"sublinear (n^{k:.2f})"
+    if k < 1.4:
+        return f"linear (n^{k:.2f})"
+    if k < 1.8:
+        return f"superlinear (n^{k:.2f})"
+    return f"quadratic+ (n^{k:.2f})"
+
+def format_time(seconds):
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 5000, 50000], help="pupils in each made up school")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="only benchmarks whose name contains this")
+    args = parser.parse_args()
+    sizes = sorted(args.sizes)
+
+    paths = {}
+    for size in sizes:
+        start = time.perf_counter()
+        paths[size] = synthetic_school.school(size, args.seed)
+        print(f"{size} pupils: {paths[size]} ({time.perf_counter() - start:.1f}s)")
+
+    # main works on DB.db in the current folder, so give it a scratch folder of its own
+    folder = tempfile.mkdtemp()
+    os.symlink(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "WEBPAGE"), os.path.join(folder, "WEBPAGE"))
+    os.chdir(folder)
+    import app_logging
+    app_logging.setup(level=logging.WARNING) # timing the functions, not the logging
+    import DB_interface
+    import enc
+    shutil.copy(paths[sizes[0]], "DB.db")
+    import main as app
+    import presence
+
+    results = {} # name -> [seconds per size]
+    for size in sizes:
+        shutil.copy(paths[size], os.path.join(folder, f"school-{size}.db")) # update_current_location writes
+        DB_interface.db = os.path.join(folder, f"school-{size}.db")
+        app.timetable_cache.clear()
+        presence.forget_slots()
+        for name, fn in benchmarks(app, DB_interface, enc, presence, size).items():
+            if args.only and args.only not in name:
+                continue
+            results.setdefault(name, []).append(per_call(fn, random.Random(args.seed)))
+        print(f"done {size}")
+
+    width = max(len(name) for name in results) + 2
+    print()
+    print("".join([f"{'benchmark':<{width}}"] + [f"{f'{size} pupils':>15}" for size in sizes] + ["   scaling"]))
+    for name, times in results.items():
+        print("".join([f"{name:<{width}}"] + [f"{format_time(t):>15}" for t in times] + ["   " + growth(sizes, times)]))
+
+    DB_interface.stop_writer()
+    os.chdir(tempfile.gettempdir())
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "WEBPAGE"))
+import DB_interface
+import migrations
+
+# makes a made up school of any size with the same tables the import script fills,
+# seeded so the same size always gives the same database
+
+PERIODS = [("08:35", "09:20"), ("09:25", "10:10"), ("10:30", "11:15"), ("11:20", "12:05"),
+           ("12:10", "12:55"), ("13:55", "14:40"), ("14:45", "15:30")]
+ZONES = ["Home", "DT", "Humanity", "Old-library", "Chemistry", "Physics", "Oxley", "Music", "PE", "Maths", "Biology", "NW"]
+HOUSES = [f"House {i}" for i in range(1, 8)]
+FORMS = [f"Form {c}" for c in "ABCDEFG"]
+SETS_PER_PUPIL = 8
+SET_SIZE = 20
+LESSONS_PER_SET = 6 # per fortnight
+PUPILS_PER_TEACHER = 12
+PUPIL_IDS = 100000 # pupil UserIDs start here, teachers start at 1
+
+
+def cached_path(pupils, seed=1):
+    # reused between runs, the schema version is in the name so a new migration makes a new file
+    version = max(number for number, name, step in migrations.MIGRATIONS)
+    return os.path.join(tempfile.gettempdir(), f"cs-nea-school-{pupils}-{seed}-v{version}.db")
+
+def school(pupils, seed=1):
+    path = cached_path(pupils, seed)
+    if not os.path.exists(path):
+        build(path, pupils, seed)
+    return path
+
+def build(path, pupils, seed=1):
+    rng = random.Random(seed)
+    temp = path + ".tmp"
+    if os.path.exists(temp):
+        os.remove(temp)
+    old_db = DB_interface.db
+    DB_interface.db = temp
+    try:
+        migrations.run_migrations()
+    finally:
+        DB_interface.db = old_db
+
+    conn = sqlite3.connect(temp)
+    conn.execute("PRAGMA synchronous=OFF")
+    rooms = ZONES + [f"{rng.choice(ZONES[1:])} Room {i}" for i in range(max(40, pupils // 40))]
+    conn.executemany("INSERT INTO LOCATIONS (LocationID, LocationName) VALUES (?, ?)", enumerate(rooms, 1))
+
+    teachers = max(5, pupils // PUPILS_PER_TEACHER)
+    conn.executemany(
+        "INSERT INTO ACCOUNTS (UserID, FirstName, LastName, SchoolEmail, Gender, RoleID, Password) VALUES (?, ?, ?, ?, ?, 1, ?)",
+        ((i, f"Teacher{i}", f"Staff{i}", f"teacher{i}@school.co.uk", rng.choice("mf"), "x") for i in range(1, teachers + 1))
+    )
+
+    sets = max(1, pupils * SETS_PER_PUPIL // SET_SIZE)
+    conn.executemany(
+        "INSERT INTO SUBJECTS (SubjectID, Name, UserID, EventID) VALUES (?, ?, ?, 1)",
+        ((i, f"Set {i}", rng.randint(1, teachers)) for i in range(1, sets + 1))
+    )
+    set_lessons = {
+        i: [(rng.randint(1, len(rooms)), rng.randint(0, 4), rng.randint(1, 2), rng.choice(PERIODS)) for _ in range(LESSONS_PER_SET)]
+        for i in range(1, sets + 1)
+    }
+
+    def pupil_rows():
+        for n in range(pupils):
+            user_id = PUPIL_IDS + n
+            yield (user_id, f"Pupil{n}", f"Surname{rng.randint(0, pupils)}", f"pupil{n}@school.co.uk", rng.choice("mf"))
+    conn.executemany(
+        "INSERT INTO ACCOUNTS (UserID, FirstName, LastName, SchoolEmail, Gender, RoleID, Password) VALUES (?, ?, ?, ?, ?, 0, 'x')",
+        pupil_rows()
+    )
+    conn.executemany(
+        "INSERT INTO STUDENT_INFO (UserID, Form, House, TimeTableID, Year) VALUES (?, ?, ?, ?, ?)",
+        ((PUPIL_IDS + n, rng.choice(FORMS), rng.choice(HOUSES), PUPIL_IDS + n, rng.randint(9, 13)) for n in range(pupils))
+    )
+
+    conn.executemany(
+        "INSERT INTO SET_LESSONS (SetID, SetCode, LocationID, SubjectID, Start, End, Day, Week) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        ((subject_id, f"Set {subject_id}", location_id, subject_id, start, end, day, week)
+         for subject_id, lessons in set_lessons.items() for location_id, day, week, (start, end) in lessons)
+    )
+    conn.executemany(
+        "INSERT INTO PUPIL_SETS (TimeTableID, SetID) VALUES (?, ?)",
+        ((PUPIL_IDS + n, subject_id) for n in range(pupils) for subject_id in rng.sample(range(1, sets + 1), min(SETS_PER_PUPIL, sets)))
+    )
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    os.replace(temp, path)
+    return path
+
+def pupil_ids(pupils):
+    return range(PUPIL_IDS, PUPIL_IDS + pupils)
+
+
+if __name__ == '__main__':
+    for size in map(int, sys.argv[1:] or ["500"]):
+        print(school(size))
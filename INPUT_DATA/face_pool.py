@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# keeps pools of already analysed faces, split by gender and age, so the import
+# never has to fetch and analyse images one at a time until one happens to fit
+
+IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".webp")
+MIN_CONFIDENCE = 95 # gender confidence needed, same as the old is_gender_match
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def age_band(age):
+    return int(age) // 10 * 10 # 20 -> 20-29
+
+
+class WebSource:
+    # random faces from thispersondoesnotexist.com, fetched a few at a time
+    def __init__(self, url="https://thispersondoesnotexist.com", threads=8):
+        self.url = url
+        self.threads = threads
+
+    def fetch_one(self, _=None):
+        import requests
+        response = requests.get(self.url, timeout=5)
+        if response.status_code == 200:
+            return response.content
+        raise Exception(f"Failed to fetch image from {self.url}")
+
+    def batch(self, n):
+        with ThreadPoolExecutor(self.threads) as pool:
+            results = list(pool.map(self._safe_fetch, range(n)))
+        return [data for data in results if data]
+
+    def _safe_fetch(self, _):
+        try:
+            return self.fetch_one()
+        except Exception as e:
+            print("Error fetching face:", e)
+            return None
+
+
+class DirectorySource:
+    # faces from a local folder (e.g. faces/), works without a network
+    def __init__(self, path):
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_TYPES)
+        )
+        self.position = 0
+
+    def batch(self, n):
+        files = self.files[self.position:self.position + n]
+        self.position += len(files)
+        result = []
+        for file in files:
+            with open(file, "rb") as f:
+                result.append(f.read())
+        return result
+
+
+def analyse(data):
+    # runs in a worker process, returns {"gender": "m"/"f"/None, "confidence", "age"}
+    import cv2
+    import numpy as np
+    from deepface import DeepFace
+    try:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+        analysis = DeepFace.analyze(
+            img_rgb,
+            actions=['gender', 'age'],
+            enforce_detection=False,
+            detector_backend='retinaface'
+        )
+        if isinstance(analysis, list):
+            analysis = analysis[0]
+
+        gender_pred = analysis.get('gender', None)
+        age = analysis.get('age', None)
+        if not gender_pred or age is None:
+            return {"gender": None, "confidence": 0, "age": None}
+
+        if isinstance(gender_pred, dict):
+            predicted_gender = max(gender_pred, key=gender_pred.get)
+            confidence = float(gender_pred[predicted_gender])
+        else:
+            predicted_gender = str(gender_pred)
+            confidence = 95.0
+
+        gender = None
+        if predicted_gender.lower().startswith('m'):
+            gender = 'm'
+        elif predicted_gender.lower().startswith(('f', 'w')):
+            gender = 'f'
+        return {"gender": gender, "confidence": confidence, "age": int(age)}
+    except Exception as e:
+        print("Error in analyse:", e)
+        return {"gender": None, "confidence": 0, "age": None}
+
+
+class FacePool:
+    def __init__(self, source, pool_dir="INPUT_DATA/face_pool", cache_path="INPUT_DATA/face_cache.json", workers=None, batch_size=16):
+        self.source = source
+        self.pool_dir = pool_dir
+        self.cache_path = cache_path
+        self.workers = workers or os.cpu_count() or 2
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.cache = {} # content hash -> analysis, kept on disk between runs
+        self.pools = defaultdict(list) # (gender, age band) -> [(age, path)]
+        self.executor = None
+        os.makedirs(pool_dir, exist_ok=True)
+        if os.path.exists(cache_path):
+            with open(cache_path, "r") as f:
+                self.cache = json.load(f)
+        self.load_pool_dir()
+
+    def load_pool_dir(self):
+        # faces analysed on an earlier run that were never used
+        for root, dirs, files in os.walk(self.pool_dir):
+            for name in files:
+                digest = os.path.splitext(name)[0]
+                result = self.cache.get(digest)
+                if result and self.usable(result):
+                    self.pools[(result["gender"], age_band(result["age"]))].append((result["age"], os.path.join(root, name)))
+
+    def usable(self, result):
+        return result["gender"] in ("m", "f") and result["confidence"] >= MIN_CONFIDENCE and result["age"] is not None
+
+    def save_cache(self):
+        temp = self.cache_path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.cache, f)
+        os.replace(temp, self.cache_path) # never leaves a half written cache
+
+    def available(self, gender, max_age):
+        return sum(
+            1 for (g, band), faces in self.pools.items() if g == gender and band <= max_age
+            for age, path in faces if age <= max_age
+        )
+
+    def fill(self, needed, max_age=30):
+        # analyses candidates in parallel until there are enough faces, needed is {"m": 10, "f": 12}
+        while any(self.available(gender, max_age) < count for gender, count in needed.items()):
+            candidates = self.source.batch(self.batch_size)
+            if not candidates:
+                raise Exception("Face source ran out before the pools were full")
+            self.add(candidates)
+
+    def add(self, candidates):
+        by_hash = {content_hash(data): data for data in candidates}
+        new = [digest for digest in by_hash if digest not in self.cache]
+        if new:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.workers) # models load once per worker
+            for digest, result in zip(new, self.executor.map(analyse, [by_hash[d] for d in new])):
+                self.cache[digest] = result
+            self.save_cache()
+
+        for digest, data in by_hash.items():
+            result = self.cache[digest]
+            if not self.usable(result):
+                continue
+            folder = os.path.join(self.pool_dir, result["gender"], str(age_band(result["age"])))
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, digest + ".img")
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(data)
+                self.pools[(result["gender"], age_band(result["age"]))].append((result["age"], path))
+
+    def take(self, gender, max_age=30):
+        # image bytes of an unused face of that gender no older than max_age
+        with self.lock:
+            self.fill({gender: 1}, max_age)
+            for band in sorted(b for g, b in self.pools if g == gender and b <= max_age):
+                faces = self.pools[(gender, band)]
+                for i, (age, path) in enumerate(faces):
+                    if age <= max_age:
+                        faces.pop(i)
+                        with open(path, "rb") as f:
+                            data = f.read()
+                        os.remove(path) # used now, so out of the pool
+                        return data
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def save_png(data, path):
+    import cv2
+    import numpy as np
+    cv2.imwrite(path, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR))
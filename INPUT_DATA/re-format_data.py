@@ -6,220 +6,211 @@ import gender_guesser.detector as gender_detector
 from password_generator import PasswordGenerator
 import os
 import hashlib
-import requests
-import numpy as np
-import cv2
-from deepface import DeepFace
+import face_pool
 from datetime import datetime, timedelta
+from collections import defaultdict
+
+detector = gender_detector.Detector() # slow to build so only do it once
 
 def determine_gender(name):
-    guessed_gender = gender_detector.Detector().get_gender(name)
+    guessed_gender = detector.get_gender(name)
     if guessed_gender in ['mostly_male', 'mostly_female', 'andy']:
         return 'unknown'
     else:
         return guessed_gender
 
-def get_random_face_image():
-    response = requests.get("https://thispersondoesnotexist.com", timeout=5)
-    if response.status_code == 200:
-        image_array = np.asarray(bytearray(response.content), dtype=np.uint8)
-        return cv2.imdecode(image_array, cv2.IMREAD_COLOR)
-    else:
-        raise Exception("Failed to fetch image from thispersondoesnotexist.com")
-
-def is_gender_match(image, target_gender, min_age=30):
-    try:
-        img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-        analysis = DeepFace.analyze(
-            img_rgb,
-            actions=['gender', 'age'],
-            enforce_detection=False,
-            detector_backend='retinaface'
+def main():
+    # Load your Excel data and convert to JSON/dict
+    Pupil_data = pd.read_excel('INPUT_DATA/Pupil_data.xlsx')
+    Pupil_data = json.loads(Pupil_data.to_json(orient='records'))
+
+    Pupil_Timetable_data = pd.read_excel('INPUT_DATA/Pupil_Timetable_data.xlsx')
+    Pupil_Timetable_data = json.loads(Pupil_Timetable_data.to_json(orient='records'))
+
+    Set_Timetable_data = pd.read_excel('INPUT_DATA/Set_Timetable_data.xlsx')
+    Set_Timetable_data = json.loads(Set_Timetable_data.to_json(orient='records'))
+
+    for row in Pupil_Timetable_data:
+        row['Pupil Code'] = str(row['Pupil Code'])
+        row['Set Code'] = str(row['Set Code'])
+        row['Subject'] = str(row['Subject'])
+        row['Teacher'] = str(row['Teacher'])
+
+    for row in Pupil_data:
+        row['Pupil ID'] = str(row['Pupil ID'])
+        row['Form'] = str(row['Form'])
+        row['Boarding House'] = str(row['Boarding House'])
+        row['Gender'] = str(row['Gender'])
+
+    for row in Set_Timetable_data:
+        row['Set Code'] = str(row['Set Code'])
+        row['Classroom'] = str(row['Classroom'])
+        row['Period ID'] = str(row['Period ID'])
+
+
+    with open("INPUT_DATA/FirstNames.txt", "r") as file:
+        first_names = [name.strip() for name in file.readlines()]
+
+    with open("INPUT_DATA/LastNames.txt", "r") as file:
+        last_names = [name.strip() for name in file.readlines()]
+
+    with open("INPUT_DATA/periods.json", "r") as file:
+        periods = json.load(file)
+
+    pwo = PasswordGenerator()
+    faces_dir = "faces"
+    os.makedirs(faces_dir, exist_ok=True)
+
+    face_source = face_pool.WebSource() # or face_pool.DirectorySource("some/folder") to run offline
+    faces = face_pool.FacePool(face_source)
+
+
+    setup=False
+    bulk=True # True: everything goes in one transaction at the end, False: commits after each pupil
+    if setup:
+        DB_interface.execute_query("INSERT INTO EVENTS (Type) VALUES (?)", ("Academic Lesson",))
+        DB_interface.execute_query("INSERT INTO EVENTS (Type) VALUES (?)", ("Music Lesson",))
+        DB_interface.execute_query("INSERT INTO EVENTS (Type) VALUES (?)", ("Sport",))
+
+        DB_interface.execute_query("INSERT INTO ROLES (RoleID, RoleName) VALUES (?, ?)", (0,"Pupil"))
+        DB_interface.execute_query("INSERT INTO ROLES (RoleID, RoleName) VALUES (?, ?)", (1,"Teacher"))
+        DB_interface.execute_query("INSERT INTO ROLES (RoleID, RoleName) VALUES (?, ?)", (2,"Admin"))
+
+    # index the spreadsheets once instead of scanning them for every pupil
+    sets_by_pupil = defaultdict(list) # Pupil Code -> rows of Pupil_Timetable_data
+    for row in Pupil_Timetable_data:
+        sets_by_pupil[row["Pupil Code"]].append(row)
+
+    lessons_by_set = defaultdict(list) # Set Code -> rows of Set_Timetable_data
+    for row in Set_Timetable_data:
+        lessons_by_set[row["Set Code"]].append(row)
+
+    # one connection for the whole import, the tables come from WEBPAGE/migrations.py (run it first on a new db)
+    conn = DB_interface.connect()
+    cur = conn.cursor()
+
+    # LocationName -> LocationID and (Name, UserID, EventID) -> SubjectID, so each is only looked up once
+    location_ids = dict(cur.execute("SELECT LocationName, LocationID FROM LOCATIONS").fetchall())
+    subject_ids = {(name, str(user), event): subject for subject, name, user, event in cur.execute("SELECT SubjectID, Name, UserID, EventID FROM SUBJECTS").fetchall()}
+
+    def location_id(location):
+        if location not in location_ids:
+            cur.execute("INSERT INTO LOCATIONS (LocationName) VALUES (?)", (location,))
+            location_ids[location] = cur.lastrowid
+        return location_ids[location]
+
+    def subject_id(subject_name, teacher):
+        key = (subject_name, str(teacher), 0)
+        if key not in subject_ids:
+            cur.execute("INSERT INTO SUBJECTS (Name, UserID, EventID) VALUES (?, ?, ?)", (subject_name, teacher, 0))
+            subject_ids[key] = cur.lastrowid
+        return subject_ids[key]
+
+    # (Set Code, SubjectID) -> SetID, a sets lessons are only written once however many pupils are in it
+    set_ids = {(code, subject): set_id for code, subject, set_id in cur.execute("SELECT DISTINCT SetCode, SubjectID, SetID FROM SET_LESSONS WHERE SetCode IS NOT NULL").fetchall()}
+    next_set_id = cur.execute("SELECT COALESCE(MAX(SetID), 0) FROM SET_LESSONS").fetchone()[0]
+
+    def set_id(set_code, subject):
+        nonlocal next_set_id
+        key = (set_code, subject)
+        if key not in set_ids:
+            next_set_id += 1
+            set_ids[key] = next_set_id
+            for set in lessons_by_set[set_code]:
+                data = periods[set["Period ID"]]
+                lesson_rows.append((next_set_id, set_code, location_id(set["Classroom"]), subject, data['start'], data['end'], data['day'], data['week']))
+        return set_ids[key]
+
+    def pupil_sets(TTID):
+        return {(TTID, set_id(i["Set Code"], subject_id(i["Subject"], i["Teacher"]))) for i in sets_by_pupil[TTID]}
+
+    lesson_rows = []
+    pupil_set_rows = []
+    account_rows = []
+    student_rows = []
+
+    def flush():
+        cur.executemany(
+            "INSERT INTO SET_LESSONS (SetID, SetCode, LocationID, SubjectID, Start, End, Day, Week) VALUES (?,?,?,?,?,?,?,?)",
+            lesson_rows
         )
-
-        if isinstance(analysis, list):
-            analysis = analysis[0]
-
-        gender_pred = analysis.get('gender', None)
-        age = analysis.get('age', None)
-
-        if not gender_pred or age is None:
-            return False
-
-        if isinstance(gender_pred, dict):
-            predicted_gender = max(gender_pred, key=gender_pred.get)
-            confidence = gender_pred[predicted_gender]
-
-            if confidence < 95:
-                return False
-        elif isinstance(gender_pred, str):
-            predicted_gender = gender_pred
-            confidence = 95
-        else:
-            return False
-
-        predicted_gender_char = None
-        if predicted_gender.lower().startswith('m'):
-            predicted_gender_char = 'm'
-        elif predicted_gender.lower().startswith(('f', 'w')):
-            predicted_gender_char = 'f'
-        else:
-            return False
-
-        if age > min_age:
-            return False
-
-        return predicted_gender_char == target_gender.lower()
-
-    except Exception as e:
-        print("Error in is_gender_match:", e)
-        return False
-
-# Load your Excel data and convert to JSON/dict
-Pupil_data = pd.read_excel('INPUT_DATA/Pupil_data.xlsx')
-Pupil_data = json.loads(Pupil_data.to_json(orient='records'))
-
-Pupil_Timetable_data = pd.read_excel('INPUT_DATA/Pupil_Timetable_data.xlsx')
-Pupil_Timetable_data = json.loads(Pupil_Timetable_data.to_json(orient='records'))
-
-Set_Timetable_data = pd.read_excel('INPUT_DATA/Set_Timetable_data.xlsx')
-Set_Timetable_data = json.loads(Set_Timetable_data.to_json(orient='records'))
-
-for row in Pupil_Timetable_data:
-    row['Pupil Code'] = str(row['Pupil Code'])
-    row['Set Code'] = str(row['Set Code'])
-    row['Subject'] = str(row['Subject'])
-    row['Teacher'] = str(row['Teacher'])
-
-for row in Pupil_data:
-    row['Pupil ID'] = str(row['Pupil ID'])
-    row['Form'] = str(row['Form'])
-    row['Boarding House'] = str(row['Boarding House'])
-    row['Gender'] = str(row['Gender'])
-
-for row in Set_Timetable_data:
-    row['Set Code'] = str(row['Set Code'])
-    row['Classroom'] = str(row['Classroom'])
-    row['Period ID'] = str(row['Period ID'])
-
-
-with open("INPUT_DATA/FirstNames.txt", "r") as file:
-    first_names = [name.strip() for name in file.readlines()]
-
-with open("INPUT_DATA/LastNames.txt", "r") as file:
-    last_names = [name.strip() for name in file.readlines()]
-
-with open("INPUT_DATA/periods.json", "r") as file:
-    periods = json.load(file)
-
-pwo = PasswordGenerator()
-faces_dir = "faces"
-os.makedirs(faces_dir, exist_ok=True)
-
-
-setup=False
-if setup:
-    DB_interface.execute_query("INSERT INTO EVENTS (Type) VALUES (?)", ("Academic Lesson",))
-    DB_interface.execute_query("INSERT INTO EVENTS (Type) VALUES (?)", ("Music Lesson",))
-    DB_interface.execute_query("INSERT INTO EVENTS (Type) VALUES (?)", ("Sport",))
-
-    DB_interface.execute_query("INSERT INTO ROLES (RoleID, RoleName) VALUES (?, ?)", (0,"Pupil"))
-    DB_interface.execute_query("INSERT INTO ROLES (RoleID, RoleName) VALUES (?, ?)", (1,"Teacher"))
-    DB_interface.execute_query("INSERT INTO ROLES (RoleID, RoleName) VALUES (?, ?)", (2,"Admin"))
-
-done = DB_interface.get_data("SELECT UserID FROM ACCOUNTS")
-done = [str(x[0]) for x in done]
-for pupil in Pupil_data:
-    if pupil["Pupil ID"] in done:
-        continue
-    gender = pupil['Gender'].lower()  # 'm' or 'f'
-    g = "m" if gender == "f" else "f"
-
-    while g != gender:
-        first = random.choice(first_names)
-        det = determine_gender(first)
-        if det != 'unknown':
-            g = "m" if det == "male" else "f"
-
-    last = random.choice(last_names)
-    email = f"{first.lower()}.{last.lower()}@school.co.uk"
-    password = pwo.generate()
-    password = hashlib.sha256(password.encode()).hexdigest()
-
-    attempts = 0
-    while True:
-        face = get_random_face_image()
-        if is_gender_match(face, gender):
-            break
-        attempts += 1
-        print("fail atempt", attempts)
-
-    email_hash = hashlib.sha256(email.encode()).hexdigest()
-    image_path = os.path.join(faces_dir, f"{email_hash}.png")
-    cv2.imwrite(image_path, face)
-
-    relative_path = os.path.relpath(image_path)
-    
-
-    
-    TTID = pupil['Pupil ID']
-
-    for i in Pupil_Timetable_data:
-        if i["Pupil Code"] == TTID:
-            set_code = i["Set Code"]
-            for set in Set_Timetable_data:
-                if set["Set Code"] == set_code:
-                    location = set["Classroom"]
-                    period = set["Period ID"]
-
-                    data = periods[period]
-                    start, end, day, week = data['start'], data['end'], data['day'], data['week']
-                    
-                    
-                    LocationID = DB_interface.get_data("SELECT LocationID FROM LOCATIONS WHERE LocationName = ?", (location,))
-                    if LocationID == []:
-                        DB_interface.execute_query("INSERT INTO LOCATIONS (LocationName) VALUES (?)", (location,))
-                        LocationID = DB_interface.get_data("SELECT LocationID FROM LOCATIONS WHERE LocationName = ?", (location,))
-
-                    LocationID = LocationID[0][0]
-                    
-                    subject_name = i["Subject"]
-                    teacher = i["Teacher"]
-                    while DB_interface.get_data("SELECT SubjectID FROM SUBJECTS WHERE Name = ? AND UserID = ? AND EventID = ?", (subject_name, teacher, 0)) == []:
-                        DB_interface.execute_query("INSERT INTO SUBJECTS (Name, UserID, EventID) VALUES (?, ?, ?)", (subject_name, teacher, 0))
-                    
-                    SubjectID = DB_interface.get_data("SELECT SubjectID FROM SUBJECTS WHERE Name = ? AND UserID = ? AND EventID = ?", (subject_name, teacher, 0))
-                    SubjectID = SubjectID[0][0]
-
-                    
-                    DB_interface.execute_query(
-                    "INSERT INTO TIMETABLE (TimeTableID, LocationID, SubjectID, Start, End, Day, Week) VALUES (?,?,?,?,?,?,?)",
-                    (TTID, LocationID, SubjectID, start, end, day, week)
-                    )
-                    
-
-
-    DB_interface.execute_query(
-        "INSERT INTO ACCOUNTS (UserID, Gender, RoleID, FirstName, LastName, SchoolEmail, Password, Image) VALUES (?,?,?,?,?,?,?,?)",
-        (pupil['Pupil ID'], gender, 0, first, last, email, password, relative_path)
-    )
-
-    DB_interface.execute_query(
-        "INSERT INTO STUDENT_INFO (UserID, Form, House, TimeTableID) VALUES (?,?,?,?)",
-        (pupil['Pupil ID'], pupil['Form'], pupil['Boarding House'], TTID)
+        cur.executemany(
+            "INSERT OR IGNORE INTO PUPIL_SETS (TimeTableID, SetID) VALUES (?,?)",
+            pupil_set_rows
         )
+        cur.executemany(
+            "INSERT INTO ACCOUNTS (UserID, Gender, RoleID, FirstName, LastName, SchoolEmail, Password, Image) VALUES (?,?,?,?,?,?,?,?)",
+            account_rows
+        )
+        cur.executemany(
+            "INSERT INTO STUDENT_INFO (UserID, Form, House, TimeTableID) VALUES (?,?,?,?)",
+            student_rows
+        )
+        conn.commit()
+        lesson_rows.clear()
+        pupil_set_rows.clear()
+        account_rows.clear()
+        student_rows.clear()
+
+    done = set(str(x[0]) for x in cur.execute("SELECT UserID FROM ACCOUNTS").fetchall())
+    used_emails = set(x[0] for x in cur.execute("SELECT SchoolEmail FROM ACCOUNTS").fetchall())
+
+    # analyse enough faces for everyone up front, in parallel
+    todo = [pupil['Gender'].lower() for pupil in Pupil_data if pupil["Pupil ID"] not in done]
+    faces.fill({gender: todo.count(gender) for gender in set(todo)})
+    for pupil in Pupil_data:
+        if pupil["Pupil ID"] in done:
+            continue
+        gender = pupil['Gender'].lower()  # 'm' or 'f'
+        g = "m" if gender == "f" else "f"
+
+        while g != gender:
+            first = random.choice(first_names)
+            det = determine_gender(first)
+            if det != 'unknown':
+                g = "m" if det == "male" else "f"
+
+        last = random.choice(last_names)
+        email = f"{first.lower()}.{last.lower()}@school.co.uk"
+        n = 1
+        while email in used_emails: # SchoolEmail is unique, one clash would fail the whole bulk insert
+            n += 1
+            email = f"{first.lower()}.{last.lower()}{n}@school.co.uk"
+        used_emails.add(email)
+        password = pwo.generate()
+        password = hashlib.sha256(password.encode()).hexdigest()
+
+        face = faces.take(gender)
+
+        email_hash = hashlib.sha256(email.encode()).hexdigest()
+        image_path = os.path.join(faces_dir, f"{email_hash}.png")
+        face_pool.save_png(face, image_path)
+
+        relative_path = os.path.relpath(image_path)
+
+
+
+        TTID = pupil['Pupil ID']
+        pupil_set_rows.extend(pupil_sets(TTID))
+        account_rows.append((pupil['Pupil ID'], gender, 0, first, last, email, password, relative_path))
+        student_rows.append((pupil['Pupil ID'], pupil['Form'], pupil['Boarding House'], TTID))
+
+        if not bulk:
+            flush() # keeps what is done so far if the import is stopped
+
+    flush() # bulk mode writes everything here in one transaction
+
+    teachers = set(user for name, user, event in subject_ids)
+    cur.executemany(
+        "INSERT OR IGNORE INTO ACCOUNTS (UserID, RoleID, FirstName, LastName, SchoolEmail, Password, Gender) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(teach, 1, "FirstName"+str(teach), "LastName"+str(teach), "FirstName"+str(teach)+"LastName"+str(teach)+"@school-teacher.com", "password", "M/F") for teach in teachers]
+    )
+    conn.commit()
+    DB_interface.close(conn)
+    faces.close()
+    print(f"Imported, {len(teachers)} teachers")
+    # the web app caches timetables per process, restart it after an import
 
-data = DB_interface.get_data("SELECT UserID FROM SUBJECTS")
-
-data = [row[0] for row in data]
 
-for teach in set(data):
-    print(teach)
-    f = "FirstName"+str(teach)
-    l = "LastName"+str(teach)
-    se = f+l+"@school-teacher.com"
-    DB_interface.execute_query(
-        "INSERT INTO ACCOUNTS (UserID, RoleID, FirstName, LastName, SchoolEmail, Password, Gender) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (teach,1,f,l,se, "password","M/F")
-        )
\ No newline at end of file
+if __name__ == '__main__': # the face workers re-import this file on Windows
+    main()
@@ -4,4 +4,5 @@ DB_interface.execute_query("DELETE FROM LOCATIONS")
 DB_interface.execute_query("DELETE FROM SIGNS")
 DB_interface.execute_query("DELETE FROM STUDENT_INFO")
 DB_interface.execute_query("DELETE FROM SUBJECTS")
-DB_interface.execute_query("DELETE FROM TIMETABLE")
\ No newline at end of file
+DB_interface.execute_query("DELETE FROM SET_LESSONS")
+DB_interface.execute_query("DELETE FROM PUPIL_SETS")
\ No newline at end of file
@@ -1,45 +1,215 @@
 import sqlite3
+import threading
+import queue
+import time
+import atexit
+from concurrent.futures import Future
 db = "DB.db"
 
+# connection pool settings
+pool_size = 8 # max idle connections kept open
+cache_size = -16000 # page cache per connection in KiB (negative = KiB)
+mmap_size = 64 * 1024 * 1024 # 64MB memory mapped reads
+busy_timeout = 5000 # ms to wait for a lock before giving up
+
+# writer settings, every write goes through one thread that commits in groups
+write_batch_size = 64 # most writes committed together
+write_batch_wait = 0.002 # seconds to wait for more writes to share a commit
+
+_pool = queue.LifoQueue(maxsize=pool_size) # most recently used first so it stays warm
+_pool_lock = threading.Lock()
+_pool_db = db # the db the pooled connections point at
+
+_writes = queue.Queue() # (query, params, future), None stops the writer
+_writer = None
+_writer_lock = threading.Lock()
+
+_observers = [] # fn(kind, query, params, seconds, rows) called after every call, kind is read, write or submit
+
+def add_observer(fn):
+    if fn not in _observers:
+        _observers.append(fn)
+
+def remove_observer(fn):
+    if fn in _observers:
+        _observers.remove(fn)
+
+def _notify(kind, query, params, started, rows):
+    seconds = time.perf_counter() - started
+    for fn in list(_observers):
+        try:
+            fn(kind, query, params, seconds, rows)
+        except Exception as e: # a broken observer mustnt break the query
+            print(f"Error in observer: {e}")
+
+def _open(isolation_level=""):
+    conn = sqlite3.connect(db, check_same_thread=False, isolation_level=isolation_level) # shared between request threads, one at a time
+    conn.execute("PRAGMA journal_mode=WAL") # readers dont block the writer
+    conn.execute("PRAGMA synchronous=NORMAL") # safe with WAL and much fewer fsyncs
+    conn.execute(f"PRAGMA cache_size={int(cache_size)}")
+    conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+    return conn
+
 def connect():
-    try: # tries to connect
-        conn = sqlite3.connect(db) # to the database
-        return conn # returns the connection as an pointer
+    global _pool_db
+    try: # tries to reuse a pooled connection
+        with _pool_lock:
+            if _pool_db != db: # db was changed, old connections point at the wrong file
+                close_all()
+                _pool_db = db
+        try:
+            return _pool.get_nowait() # returns an idle connection
+        except queue.Empty:
+            return _open() # pool empty so open a new one
     except sqlite3.Error as e: # if it failes due to an error
         print(f"Error in connect: {e}") # prints the error
         return None
 
-def close(conn): # closes the connection
+def close(conn): # gives the connection back to the pool
     if conn: # if the connection exists
-        conn.close() # close it
+        if conn.in_transaction: # never hand out a connection mid transaction
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn) # keep it for the next call
+        except queue.Full:
+            conn.close() # pool full so actually close it
+
+def close_all(): # closes every idle connection in the pool
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
 
-def get_data(query, params=()): 
+def get_data(query, params=()):
+    started = time.perf_counter()
     conn = connect() # connects to the DB
     try:
         cursor = conn.cursor() # creates a cursor object
         cursor.execute(query, params) # executes the query with params
         rows = cursor.fetchall() # fetches all the data
         close(conn) # closes the connection
+        if _observers:
+            _notify("read", query, params, started, len(rows))
         return rows # returns the data
     except sqlite3.Error as e: # if it failes due to an error
         print(f"Error in get_data: {e}") # prints the error
         close(conn) # closes the connection
+        if _observers:
+            _notify("read", query, params, started, 0)
         return [] # returns an empty list
-    
+
 def execute_query(query, params=()):
-    conn = connect() # connects to the DB
+    started = time.perf_counter()
+    future = _queue_write(query, params)
+    result = future.result() # waits for the commit so callers can read it back
+    if _observers:
+        _notify("write", query, params, started, getattr(future, "rowcount", None))
+    return result
+
+def submit_query(query, params=()):
+    # queues a write for the writer thread, the future gives True/False once committed
+    started = time.perf_counter()
+    future = _queue_write(query, params)
+    if _observers:
+        _notify("submit", query, params, started, None)
+    return future
+
+def _queue_write(query, params):
+    future = Future()
+    _start_writer()
+    _writes.put((query, params, future))
+    return future
+
+def _start_writer():
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                _writer = threading.Thread(target=_write_loop, name="db-writer", daemon=True)
+                _writer.start()
+
+def _write_loop():
+    conn = None
+    conn_db = None
+    while True:
+        first = _writes.get()
+        if first is None: # asked to stop
+            break
+        batch = [first]
+        deadline = time.monotonic() + write_batch_wait
+        while len(batch) < write_batch_size: # gather anything else that turns up in time
+            try:
+                item = _writes.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                _writes.put(None) # stop after this batch
+                break
+            batch.append(item)
+
+        try:
+            if conn is None or conn_db != db: # first write, or the db was changed
+                if conn:
+                    conn.close()
+                conn = _open(isolation_level=None) # we handle the transactions ourselves
+                conn_db = db
+        except Exception as e:
+            print(f"Error in connect: {e}")
+            conn = None
+            for query, params, future in batch:
+                future.set_result(False)
+            continue
+        try:
+            _commit_batch(conn, batch)
+        except Exception as e: # the futures are already answered, keep the writer alive
+            print(f"Error in writer: {e}")
+    if conn:
+        conn.close()
+
+def _commit_batch(conn, batch):
+    results = {} # future -> True/False, anything missing when we finish counts as failed
     try:
-        cursor = conn.cursor() # creates a cursor object
-        cursor.execute(query, params) # executes the query with params
-        conn.commit() # commits the changes
-        close(conn) # closes the connection
-        return True
-    except sqlite3.Error as e: # if it failes due to an error
-        print(f"Error in execute_query: {e}") # prints the error
-        close(conn) # closes the connection
-        return False
-    
-def get_data_colums(query, params=()): 
+        conn.execute("BEGIN IMMEDIATE")
+        for query, params, future in batch:
+            try:
+                conn.execute("SAVEPOINT op") # so one bad write doesnt undo the rest
+                future.rowcount = conn.execute(query, params).rowcount
+                conn.execute("RELEASE op")
+                results[future] = True
+            except Exception as e: # bad sql or bad params (an int too big for sqlite is an OverflowError)
+                print(f"Error in execute_query: {e}") # prints the error
+                conn.execute("ROLLBACK TO op")
+                conn.execute("RELEASE op")
+                results[future] = False
+        conn.execute("COMMIT") # one commit for the whole group
+    except Exception as e:
+        print(f"Error in execute_query: {e}")
+        try:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        except Exception as e:
+            print(f"Error in rollback: {e}")
+        results = {}
+    finally:
+        # every caller gets an answer, even if the writer is on its way down
+        for query, params, future in batch:
+            if not future.done():
+                future.set_result(results.get(future, False))
+
+def stop_writer():
+    # finishes the queued writes then stops the writer thread
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        _writes.put(None)
+        _writer.join()
+    _writer = None
+
+atexit.register(stop_writer)
+
+def get_data_colums(query, params=()):
+    started = time.perf_counter()
     conn = connect() # connects to the DB
     try:
         cursor = conn.cursor() # creates a cursor object
@@ -47,8 +217,12 @@ def get_data_colums(query, params=()):
         rows = cursor.fetchall() # fetches all the data
         columns = [desc[0] for desc in cursor.description] # gets the column names
         close(conn) # closes the connection
+        if _observers:
+            _notify("read", query, params, started, len(rows))
         return rows, columns # returns the data and column names
     except sqlite3.Error as e: # if it failes due to an error
         print(f"Error in get_data: {e}") # prints the error
         close(conn) # closes the connection
+        if _observers:
+            _notify("read", query, params, started, 0)
         return [], [] # returns 2 empty lists
\ No newline at end of file
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+import queue
+import atexit
+import logging
+import itertools
+import threading
+import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# request threads only put records on a queue, one listener thread does the
+# file and console writes. the file gets one JSON object per line
+
+LOG_FILE = "app.log"
+MAX_BYTES = 10 * 1024 * 1024 # rotate app.log at 10MB
+BACKUPS = 7 # app.log.1 ... app.log.7 are kept
+QUEUE_SIZE = 10000 # records waiting for the listener, past this they are dropped rather than blocking a request
+
+# per endpoint rules, "sample" keeps 1 in N records below WARNING, "level" is the lowest level kept
+ROUTE_RULES = {
+    "check_location": {"sample": 20},
+    "check_location_batch": {"sample": 20},
+    "change_image": {"level": logging.WARNING},
+    "avatar": {"level": logging.WARNING},
+}
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    # same timestamp as before so the log viewer can still filter by time
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if getattr(record, "route", None):
+            entry["route"] = record.route
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RouteFilter(logging.Filter):
+    # runs on the request thread, tags the record with the endpoint then applies ROUTE_RULES
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = rules
+        self.counters = {route: itertools.count() for route in rules}
+
+    def filter(self, record):
+        record.route = current_route()
+        rule = self.rules.get(record.route)
+        if not rule:
+            return True
+        if record.levelno < rule.get("level", logging.NOTSET):
+            return False
+        sample = rule.get("sample", 1)
+        if sample > 1 and record.levelno < logging.WARNING: # warnings and errors are always kept
+            return next(self.counters[record.route]) % sample == 0
+        return True
+
+def current_route():
+    try:
+        from flask import has_request_context, request
+        return request.endpoint if has_request_context() else None
+    except ImportError:
+        return None
+
+
+class DropQueueHandler(QueueHandler):
+    # QueueHandler but a full queue drops the record instead of raising in the request
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+class SizeAndTimeRotatingHandler(RotatingFileHandler):
+    # rotates when the file gets to maxBytes or at midnight, whichever comes first
+    def __init__(self, filename, maxBytes, backupCount, encoding="utf-8"):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        started = os.path.getmtime(filename) if os.path.exists(filename) else time.time()
+        self.rollover_at = next_midnight(started) # yesterdays file is rotated on the first write today
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = next_midnight(time.time())
+
+def next_midnight(timestamp):
+    day = datetime.date.fromtimestamp(timestamp) + datetime.timedelta(days=1)
+    return datetime.datetime.combine(day, datetime.time()).timestamp()
+
+
+def setup(name="my_logger", level=logging.INFO, path=LOG_FILE, rules=None):
+    # gives back the logger with the queue in front of it, safe to call more than once
+    global _listener, _handler
+    logger = logging.getLogger(name)
+    with _setup_lock:
+        if _listener is not None:
+            return logger
+        file_handler = SizeAndTimeRotatingHandler(path, MAX_BYTES, BACKUPS)
+        file_handler.setLevel(level)
+        file_handler.setFormatter(JsonFormatter())
+        console = logging.StreamHandler()
+        console.setLevel(level)
+        console.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+        records = queue.Queue(QUEUE_SIZE)
+        _handler = DropQueueHandler(records) # tracebacks get folded into the message here
+        _handler.addFilter(RouteFilter(ROUTE_RULES if rules is None else rules))
+        logger.setLevel(level)
+        logger.addHandler(_handler)
+
+        _listener = QueueListener(records, file_handler, console, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop)
+    return logger
+
+def stop(name="my_logger"):
+    # writes out whatever is still queued
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger(name).removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,126 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+def size_of(value):
+    # rough size in bytes, good enough to stop the cache growing forever
+    size = sys.getsizeof(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(size_of(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(size_of(k) + size_of(v) for k, v in value.items())
+    return size
+
+
+class LRUCache:
+    # least recently used cache bounded by entry count and by rough memory use
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock() # request threads share one cache
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key) # now the most recently used
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = size_of(value)
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            if size > self.max_bytes: # would never fit
+                return
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1] # drop the oldest
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+                return True
+            return False
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class PeriodCache(LRUCache):
+    # results that only hold for one lesson period, every entry is dropped when the period changes
+    # and entries can also be dropped by any of the UserIDs in them
+    def __init__(self, max_entries=500, max_bytes=16 * 1024 * 1024, max_age=60):
+        super().__init__(max_entries, max_bytes)
+        self.max_age = max_age # seconds, for the changes nobody tells us about (names, photos)
+        self.period = None
+        self.users = {} # UserID -> keys of the entries holding them, may name keys already evicted
+        self.changed = {} # UserID -> when they were last invalidated this period
+
+    def get(self, period, key, default=None):
+        with self.lock:
+            if period != self.period: # past a bell, nothing cached is right any more
+                self.period = period
+                self.entries.clear()
+                self.users.clear()
+                self.changed.clear()
+                self.bytes = 0
+        value = super().get(key)
+        if value is None:
+            return default
+        stored, result = value
+        if time.monotonic() - stored > self.max_age:
+            self.invalidate(key)
+            return default
+        return result
+
+    def put(self, period, key, result, user_ids=(), started=None):
+        # started is time.monotonic() from before the result was worked out, so a result that
+        # raced a change to one of its users is not kept
+        user_ids = list(user_ids)
+        with self.lock:
+            if period != self.period: # the period changed while this was being worked out
+                return
+            if started is not None and any(self.changed.get(user_id, -1) >= started for user_id in user_ids):
+                return
+            for user_id in user_ids:
+                self.users.setdefault(user_id, set()).add(key)
+        super().put(key, (time.monotonic(), result))
+
+    def invalidate_user(self, user_id):
+        # drops every entry that user is in, returns how many there were
+        with self.lock:
+            keys = self.users.pop(user_id, ())
+            self.changed[user_id] = time.monotonic()
+        return sum(self.invalidate(key) for key in keys)
+
+    def clear(self):
+        with self.lock:
+            self.users.clear()
+            self.changed.clear()
+        super().clear()
@@ -0,0 +1,42 @@
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+
+class Geofence:
+    # finds which zone a GPS fix is in using an STRtree over the zone bounding boxes
+    # and prepared polygons for the exact test, so each fix only checks nearby zones
+    def __init__(self, zones):
+        self.names = list(zones) # dict order is the priority when zones overlap
+        self.polygons = np.array([zones[name] for name in self.names], dtype=object)
+        shapely.prepare(self.polygons) # builds the fast point in polygon structures once
+        self.tree = STRtree(self.polygons)
+
+    def locate(self, lon, lat):
+        # zone name for one fix, or None if it is outside every zone
+        return self.classify([(lon, lat)])[0]
+
+    def classify(self, points):
+        # zone name (or None) for each (lon, lat) in points, all in one go
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        result = [None] * len(points)
+        if len(points) == 0 or len(self.names) == 0:
+            return result
+
+        # candidate (point, zone) pairs whose bounding boxes overlap
+        point_index, zone_index = self.tree.query(shapely.points(points))
+        if len(point_index) == 0:
+            return result
+
+        # exact test on just the candidates
+        inside = shapely.contains_xy(
+            self.polygons[zone_index], points[point_index, 0], points[point_index, 1]
+        )
+
+        best = {}
+        for p, z in zip(point_index[inside], zone_index[inside]):
+            if p not in best or z < best[p]: # first zone in dict order wins, like the old loop
+                best[p] = z
+        for p, z in best.items():
+            result[p] = self.names[z]
+        return result
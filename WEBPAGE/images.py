@@ -0,0 +1,123 @@
+import io
+import os
+import re
+import hashlib
+import tempfile
+from PIL import Image, ImageOps
+
+FACES_DIR = "WEBPAGE/static/img/faces"
+SIZES = (48, 150, 300) # px, 150 is what the tiles show, 300 for high dpi screens
+FORMATS = {"webp": ("WEBP", {"quality": 80, "method": 4}), "png": ("PNG", {"optimize": True})}
+MAIN_SIZE = 150 # also written as <name>.png, the file ACCOUNTS.Image points at
+HASHED_NAME = re.compile(r"^[0-9a-f]{32}(-\d+)?\.(png|webp)$") # content addressed, so the file never changes
+
+_has_renditions = {} # image name -> bool, saves a stat per tile per request
+
+
+def write_atomic(path, data):
+    # temp file in the same folder then rename, so nobody ever reads half an image
+    folder = os.path.dirname(path)
+    fd, temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+    except Exception:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    name, options = FORMATS[fmt]
+    image.save(buffer, name, **options)
+    return buffer.getvalue()
+
+def square(image):
+    # centre square crop
+    width, height = image.size
+    side = min(width, height)
+    left = (width - side) // 2
+    top = (height - side) // 2
+    return image.crop((left, top, left + side, top + side))
+
+def process_avatar(upload):
+    # decodes the upload once and writes every size and format, returns the ACCOUNTS.Image value
+    # files are named by a hash of their content so a new picture always gets a new URL
+    image = Image.open(upload.stream if hasattr(upload, "stream") else upload)
+    image.draft("RGB", (max(SIZES) * 2, max(SIZES) * 2)) # JPEGs decode straight at a smaller scale
+    image = ImageOps.exif_transpose(image) # phones store the rotation in EXIF
+    image = square(image.convert("RGB"))
+
+    files = {} # (size, fmt) -> bytes
+    for size in sorted(SIZES, reverse=True): # biggest first, each one scaled from the last
+        image = image.resize((size, size), Image.LANCZOS, reducing_gap=3.0)
+        for fmt in FORMATS:
+            files[(size, fmt)] = encode(image, fmt)
+
+    digest = hashlib.sha256()
+    for key in sorted(files):
+        digest.update(files[key])
+    name = digest.hexdigest()[:32]
+
+    os.makedirs(FACES_DIR, exist_ok=True)
+    for (size, fmt), data in files.items():
+        write_atomic(os.path.join(FACES_DIR, f"{name}-{size}.{fmt}"), data)
+    write_atomic(os.path.join(FACES_DIR, f"{name}.png"), files[(MAIN_SIZE, "png")])
+
+    _has_renditions[f"{name}.png"] = True
+    return f"faces\\{name}.png"
+
+def avatar_files(image):
+    # every file on disk that belongs to an ACCOUNTS.Image value
+    base = os.path.splitext(os.path.basename(image.replace("\\", "/")))[0]
+    names = [f"{base}.png"] + [f"{base}-{size}.{fmt}" for size in SIZES for fmt in FORMATS]
+    return [os.path.join(FACES_DIR, name) for name in names]
+
+def remove_avatar(image):
+    if not image:
+        return
+    for path in avatar_files(image):
+        if os.path.exists(path):
+            os.remove(path)
+    _has_renditions.pop(os.path.basename(image.replace("\\", "/")), None)
+
+def is_immutable(filename):
+    return bool(HASHED_NAME.match(os.path.basename(filename)))
+
+def etag_for(filename):
+    # the name already is the content hash, the size suffix keeps renditions apart
+    return os.path.splitext(os.path.basename(filename))[0] + os.path.splitext(filename)[1]
+
+def rendition(image, size, fmt="webp"):
+    # static path of a smaller/bigger copy of an ACCOUNTS.Image, or None for old single size images
+    if not image:
+        return None
+    image = image.replace("\\", "/")
+    folder, file = os.path.split(image)
+    base = os.path.splitext(file)[0]
+    if file not in _has_renditions:
+        _has_renditions[file] = os.path.exists(os.path.join(FACES_DIR, f"{base}-{MAIN_SIZE}.webp"))
+    if not _has_renditions[file]:
+        return None
+    return f"{folder}/{base}-{size}.{fmt}" if folder else f"{base}-{size}.{fmt}"
+
+
+def content_address_existing():
+    # renames avatars saved before names were content hashes, and points ACCOUNTS.Image at them
+    import DB_interface
+    for user_id, image in DB_interface.get_data("SELECT UserID, Image FROM ACCOUNTS WHERE Image IS NOT NULL"):
+        file = os.path.basename(image.replace("\\", "/"))
+        path = os.path.join(FACES_DIR, file)
+        if is_immutable(file) or not os.path.exists(path):
+            continue
+        with open(path, "rb") as f:
+            new_image = process_avatar(io.BytesIO(f.read()))
+        DB_interface.execute_query("UPDATE ACCOUNTS SET Image = ? WHERE UserID = ?", (new_image, user_id))
+        if not DB_interface.get_data("SELECT 1 FROM ACCOUNTS WHERE Image = ?", (image,)):
+            remove_avatar(image)
+        print(f"{image} -> {new_image}")
+
+
+if __name__ == '__main__':
+    content_address_existing()
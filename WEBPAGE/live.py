@@ -0,0 +1,123 @@
+import json
+import queue
+import logging
+import threading
+import presence
+
+logger = logging.getLogger('my_logger')
+
+# pushes presence changes to the teacher screens as server-sent events, so the tiles and list
+# pages patch the one pupil that moved instead of reloading everything
+
+KEEPALIVE = 15 # seconds between comments on a quiet stream, stops proxies closing it
+TICK = 20 # seconds between checks for the bell, so a period rolls over with nobody loading a page
+MAX_CLIENTS = 200 # every open stream holds a server thread
+QUEUE_SIZE = 1000 # events a slow screen can fall behind by before it is told to reload
+
+_clients = set()
+_lock = threading.Lock()
+_ticker = None
+_period = None # the last period key sent out
+
+
+class Client:
+    def __init__(self):
+        self.events = queue.Queue(QUEUE_SIZE)
+        self.lost = False # dropped events, so the page has to reload to be right again
+
+    def send(self, event, data):
+        try:
+            self.events.put_nowait((event, data))
+        except queue.Full:
+            self.lost = True
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def broadcast(event, data):
+    with _lock:
+        clients = list(_clients)
+    for client in clients:
+        client.send(event, data)
+
+def on_presence(event, data):
+    # runs on the DB writer thread, so only hands the event on
+    if event == "location":
+        broadcast("location", {"user_id": data["user_id"], "location_id": data["location_id"], "location": data.get("location_name")})
+    elif event == "period":
+        period_changed(data["key"])
+
+def period_changed(key):
+    global _period
+    with _lock:
+        if key == _period:
+            return
+        _period = key
+    logger.info(f"Streaming period change to {key}")
+    broadcast("period", {"key": key})
+
+def tick(stop):
+    # ensure_period refreshes PRESENCE for a new lesson, between lessons the key just goes to None
+    while not stop.wait(TICK):
+        try:
+            period_changed(presence.ensure_period(*presence.now_slot()))
+        except Exception:
+            logger.exception("Presence ticker failed")
+
+def start():
+    global _ticker, _period
+    with _lock:
+        if _ticker is not None:
+            return
+        _period = presence.period_key(*presence.now_slot())
+        _ticker = threading.Event()
+        threading.Thread(target=tick, args=(_ticker,), name="presence-ticker", daemon=True).start()
+    presence.subscribe(on_presence)
+
+def stop():
+    global _ticker
+    with _lock:
+        if _ticker is None:
+            return
+        _ticker.set()
+        _ticker = None
+    presence.unsubscribe(on_presence)
+
+def connect():
+    # a Client for a new stream, or None when there are too many open already
+    start()
+    with _lock:
+        if len(_clients) >= MAX_CLIENTS:
+            return None
+        client = Client()
+        _clients.add(client)
+    return client
+
+def disconnect(client):
+    with _lock:
+        _clients.discard(client)
+
+def stream(client):
+    # the body of the SSE response, starts with the current period so the page can tell if it is stale
+    try:
+        key = presence.ensure_period(*presence.now_slot())
+        period_changed(key) # the ticker may not have seen the bell yet
+        yield "retry: 5000\n\n"
+        yield format_event("period", {"key": key})
+        while True:
+            try:
+                event, data = client.events.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            if client.lost:
+                yield format_event("reload", {})
+                return
+            yield format_event(event, data)
+    finally:
+        disconnect(client)
+
+def clients():
+    with _lock:
+        return len(_clients)
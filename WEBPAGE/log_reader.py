@@ -0,0 +1,167 @@
+import os
+import json
+import glob
+import threading
+
+# reads app.log (and its rotated copies) from the end, a page at a time,
+# so the admin log page never loads the whole file into memory
+
+BLOCK = 64 * 1024 # bytes read per seek when going backwards
+INDEX_EVERY = 1000 # keep the byte offset of every 1000th line
+
+_indexes = {} # (device, inode) -> LineIndex, survives the file being renamed by rotation
+_lock = threading.Lock()
+
+
+def log_files(path="app.log"):
+    # newest first: app.log, then rotated copies by age
+    rotated = [p for p in glob.glob(path + ".*") if not p.endswith((".tmp", ".lock"))]
+    rotated.sort(key=os.path.getmtime, reverse=True)
+    return ([path] if os.path.exists(path) else []) + rotated
+
+def parse(line):
+    # (timestamp, level, message), lines that dont look like a log entry get an empty level
+    if line.startswith("{"): # JSON lines from app_logging
+        try:
+            entry = json.loads(line)
+            return entry.get("time", ""), entry.get("level", ""), entry.get("message", "")
+        except ValueError:
+            pass
+    parts = line.rstrip("\r\n").split(" - ", 2)
+    if len(parts) == 3:
+        return parts[0], parts[1], parts[2]
+    return "", "", line.rstrip("\r\n")
+
+
+class LineIndex:
+    # sparse index of line start offsets, only ever reads the part of the file added since last time
+    def __init__(self):
+        self.offsets = [0] # offsets[i] = byte offset of line i * INDEX_EVERY
+        self.lines = 0 # complete lines seen
+        self.indexed_to = 0 # bytes read so far
+
+    def update(self, path):
+        size = os.path.getsize(path)
+        if size < self.indexed_to: # truncated, start again
+            self.__init__()
+        with open(path, "rb") as f:
+            f.seek(self.indexed_to)
+            position = self.indexed_to
+            while position < size:
+                chunk = f.read(min(BLOCK, size - position))
+                if not chunk:
+                    break
+                start = 0
+                while True:
+                    newline = chunk.find(b"\n", start)
+                    if newline == -1:
+                        break
+                    self.lines += 1
+                    # only count up to the last full line, a half written one is picked up next time
+                    self.indexed_to = position + newline + 1
+                    if self.lines % INDEX_EVERY == 0:
+                        self.offsets.append(self.indexed_to)
+                    start = newline + 1
+                position += len(chunk)
+
+    def seek_line(self, f, line):
+        # byte offset of the start of line number `line`
+        block = min(line // INDEX_EVERY, len(self.offsets) - 1)
+        f.seek(self.offsets[block])
+        for _ in range(line - block * INDEX_EVERY):
+            if not f.readline():
+                break
+        return f.tell()
+
+
+def index_for(path):
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino)
+    with _lock:
+        index = _indexes.setdefault(key, LineIndex())
+        index.update(path)
+        return index
+
+def total_lines(path="app.log"):
+    return sum(index_for(p).lines for p in log_files(path))
+
+def read_backwards(path, end=None):
+    # yields (offset, line) from `end` (default the end of the file) back to the start
+    with open(path, "rb") as f:
+        position = os.path.getsize(path) if end is None else end
+        remainder = b""
+        while position > 0:
+            step = min(BLOCK, position)
+            position -= step
+            f.seek(position)
+            chunk = f.read(step) + remainder
+            lines = chunk.split(b"\n")
+            remainder = lines.pop(0) # may be cut off, keep it for the next block
+            offset = position + len(remainder) + 1
+            found = []
+            for line in lines:
+                found.append((offset, line))
+                offset += len(line) + 1
+            for line_offset, line in reversed(found):
+                if line:
+                    yield line_offset, line.decode("utf-8", "replace")
+        if remainder:
+            yield 0, remainder.decode("utf-8", "replace")
+
+
+def matches(entry, levels, since, until, text):
+    timestamp, level, message = entry
+    if levels and level not in levels:
+        return False
+    if since and timestamp and timestamp < since:
+        return False
+    if until and timestamp and timestamp > until:
+        return False
+    if text and text.lower() not in message.lower():
+        return False
+    return True
+
+def read_page(path="app.log", size=100, page=0, cursor=None, levels=None, since=None, until=None, text=None):
+    # returns (entries newest first, cursor for the next older page or None)
+    # cursor is "file number:byte offset", page is used to jump straight to a page with no filters
+    since = since.replace("T", " ") if since else None
+    until = until.replace("T", " ") if until else None
+    files = log_files(path)
+    filtered = bool(levels or since or until or text)
+
+    file_number, end = 0, None
+    skip = 0
+    if cursor:
+        file_number, end = (int(x) for x in cursor.split(":"))
+    elif page and not filtered:
+        file_number, end = locate_line(files, page * size)
+    else:
+        skip = page * size # filters mean we have to look at every line anyway
+
+    entries = []
+    while file_number < len(files):
+        for offset, line in read_backwards(files[file_number], end):
+            entry = parse(line)
+            if since and entry[0] and entry[0] < since: # older than the range, nothing further back can match
+                return entries, None
+            if not matches(entry, levels, since, until, text):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            if len(entries) == size:
+                return entries, f"{file_number}:{offset + len(line.encode('utf-8')) + 1}"
+            entries.append(entry)
+        file_number += 1
+        end = None
+    return entries, None
+
+def locate_line(files, lines_from_end):
+    # (file number, byte offset) that starts `lines_from_end` lines back from the newest line
+    for number, path in enumerate(files):
+        index = index_for(path)
+        if lines_from_end < index.lines:
+            with open(path, "rb") as f:
+                return number, index.seek_line(f, index.lines - lines_from_end)
+        lines_from_end -= index.lines
+    return len(files), None
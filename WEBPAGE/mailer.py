@@ -0,0 +1,229 @@
+import os
+import time
+import uuid
+import queue
+import random
+import smtplib
+import logging
+import threading
+import DB_interface
+
+logger = logging.getLogger('my_logger')
+
+# mailer settings
+WORKERS = 4 # parallel SMTP connections
+RATE = 10 # most emails per second across all workers
+MAX_ATTEMPTS = 5 # then the email is marked failed
+BACKOFF = 30 # seconds before the first retry, doubles each time
+CLAIM_SIZE = 8 # emails claimed from the OUTBOX at once, small so a new MFA code is never stuck behind many
+POLL = 5 # seconds between OUTBOX checks when nothing wakes us
+STALE_CLAIM = 300 # seconds before a claim from a dead worker is given back
+RELEASE_EVERY = 60 # seconds between checks for stale claims
+IDLE_TIMEOUT = 60 # seconds an idle SMTP connection is kept open
+
+_jobs = queue.PriorityQueue() # ((-Priority, EmailID), email) claimed and waiting for a worker, MFA codes first
+_wake = threading.Event()
+_threads = []
+_start_lock = threading.Lock()
+_claim_id = uuid.uuid4().hex # marks the rows this process has claimed
+
+
+def smtp_settings():
+    # read when used, main loads the .env file after importing this
+    return {
+        "host": os.environ.get('smtp_host', "smtp.gmail.com"),
+        "port": int(os.environ.get('smtp_port', 587)),
+        "starttls": os.environ.get('smtp_starttls', "1") == "1",
+        "user": os.environ.get('email'),
+        "password": os.environ.get('app_password'),
+        "sender": os.environ.get('email') or "noreply@localhost",
+    }
+
+def queue_email(to_email, subject, body, priority=0):
+    queue_emails([to_email], subject, [body], priority)
+
+def queue_emails(to_emails, subject, bodies, priority=0):
+    # writes the emails to the OUTBOX and wakes the dispatcher, returns straight away
+    now = int(time.time())
+    futures = [
+        DB_interface.submit_query(
+            "INSERT INTO OUTBOX (ToAddress, Subject, Body, Priority, Created) VALUES (?, ?, ?, ?, ?)",
+            (to_email, subject, body, priority, now)
+        )
+        for to_email, body in zip(to_emails, bodies)
+    ]
+    queued = sum(1 for future in futures if future.result()) # all share a few group commits
+    logger.info(f"{queued} emails queued")
+    start()
+    _wake.set()
+    return queued
+
+
+class RateLimiter:
+    # token bucket shared by the workers
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                sleep_for = (1 - self.tokens) / self.rate
+            time.sleep(sleep_for)
+
+_limiter = RateLimiter(RATE)
+
+
+def start():
+    # starts the dispatcher and worker threads once per process
+    with _start_lock:
+        if _threads:
+            return
+        release_stale_claims()
+        _threads.append(threading.Thread(target=_dispatch_loop, name="mail-dispatch", daemon=True))
+        for i in range(WORKERS):
+            _threads.append(threading.Thread(target=_worker_loop, name=f"mail-worker-{i}", daemon=True))
+        for thread in _threads:
+            thread.start()
+        logger.info(f"Mailer started with {WORKERS} workers")
+
+def release_stale_claims():
+    # emails claimed by a process that died half way are put back in the queue
+    DB_interface.execute_query(
+        "UPDATE OUTBOX SET Status = 'pending', ClaimedBy = NULL WHERE Status = 'sending' AND ClaimedAt < ?",
+        (int(time.time()) - STALE_CLAIM,)
+    )
+
+def claim(min_priority=None):
+    # marks a batch of due emails as ours in one UPDATE so two processes cant send the same one,
+    # min_priority only claims emails at least that urgent
+    now = int(time.time())
+    token = f"{_claim_id}:{now}:{random.random()}"
+    DB_interface.execute_query("""
+        UPDATE OUTBOX SET Status = 'sending', ClaimedBy = ?, ClaimedAt = ?
+        WHERE EmailID IN (
+            SELECT EmailID FROM OUTBOX
+            WHERE Status = 'pending' AND NextAttempt <= ? AND Priority >= ?
+            ORDER BY Priority DESC, EmailID
+            LIMIT ?
+        )
+    """, (token, now, now, min_priority if min_priority is not None else -2 ** 63, CLAIM_SIZE))
+    return DB_interface.get_data(
+        "SELECT EmailID, ToAddress, Subject, Body, Attempts, Priority FROM OUTBOX WHERE ClaimedBy = ? AND Status = 'sending' ORDER BY Priority DESC, EmailID",
+        (token,)
+    )
+
+def _dispatch_loop():
+    released = time.monotonic()
+    while True:
+        _wake.wait(POLL)
+        _wake.clear()
+        try:
+            if time.monotonic() - released >= RELEASE_EVERY: # a worker or process may have died since
+                release_stale_claims()
+                released = time.monotonic()
+            while True: # urgent emails are claimed however much is queued, and jump the queue
+                rows = claim(min_priority=1)
+                for row in rows:
+                    add_job(row)
+                if len(rows) < CLAIM_SIZE:
+                    break
+            while _jobs.qsize() < WORKERS * 2: # dont claim more than the workers can take soon
+                rows = claim()
+                if not rows:
+                    break
+                for row in rows:
+                    add_job(row)
+        except Exception as e:
+            logger.error(f"Mail dispatch error: {e}")
+
+def add_job(row):
+    email_id, to_email, subject, body, attempts, priority = row
+    _jobs.put(((-priority, email_id), (email_id, to_email, subject, body, attempts)))
+
+
+class Connection:
+    # one persistent SMTP session, reopened when it drops or sits idle too long
+    def __init__(self):
+        self.server = None
+        self.last_used = 0
+
+    def open(self):
+        settings = smtp_settings()
+        self.server = smtplib.SMTP(settings["host"], settings["port"], timeout=30)
+        if settings["starttls"]:
+            self.server.starttls()
+        if settings["user"] and settings["password"]:
+            self.server.login(settings["user"], settings["password"])
+
+    def close(self):
+        if self.server:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+
+    def send(self, to_email, message):
+        if self.server and time.monotonic() - self.last_used > IDLE_TIMEOUT:
+            self.close() # the server has probably hung up on us
+        for attempt in range(2): # second go on a fresh connection if it was dropped
+            if self.server is None:
+                self.open()
+            try:
+                self.server.sendmail(smtp_settings()["sender"], to_email, message.encode("utf-8"))
+                self.last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                self.server = None
+                if attempt:
+                    raise
+
+def _worker_loop():
+    connection = Connection()
+    while True:
+        try:
+            order, (email_id, to_email, subject, body, attempts) = _jobs.get(timeout=IDLE_TIMEOUT)
+        except queue.Empty:
+            connection.close() # nothing to do so let the connection go
+            continue
+        _limiter.wait()
+        try:
+            connection.send(to_email, f"Subject: {subject}\n\n{body}")
+            DB_interface.submit_query(
+                "UPDATE OUTBOX SET Status = 'sent', SentAt = ?, Attempts = ?, ClaimedBy = NULL WHERE EmailID = ?",
+                (int(time.time()), attempts + 1, email_id)
+            )
+            logger.info(f"Email sent to {to_email}")
+        except Exception as e:
+            connection.close()
+            failed(email_id, to_email, attempts + 1, e)
+        if _jobs.empty():
+            _wake.set() # ask for more work
+
+def failed(email_id, to_email, attempts, error):
+    permanent = isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused))
+    if permanent or attempts >= MAX_ATTEMPTS:
+        DB_interface.submit_query(
+            "UPDATE OUTBOX SET Status = 'failed', Attempts = ?, LastError = ?, ClaimedBy = NULL WHERE EmailID = ?",
+            (attempts, str(error), email_id)
+        )
+        logger.error(f"Email send error: {error}, giving up on {to_email}")
+        return
+    delay = BACKOFF * 2 ** (attempts - 1) * random.uniform(0.8, 1.2) # jitter so retries dont all line up
+    DB_interface.submit_query(
+        "UPDATE OUTBOX SET Status = 'pending', Attempts = ?, NextAttempt = ?, LastError = ?, ClaimedBy = NULL WHERE EmailID = ?",
+        (attempts, int(time.time() + delay), str(error), email_id)
+    )
+    logger.warning(f"Email send error: {error}, retrying {to_email} in {int(delay)}s")
+
+def outbox_counts():
+    return dict(DB_interface.get_data("SELECT Status, COUNT(*) FROM OUTBOX GROUP BY Status"))
@@ -1,39 +1,48 @@
 import socket
 import DB_interface
+import migrations
+from cache import LRUCache, PeriodCache
+import presence
+from geofence import Geofence
+import mailer
+import remember_me
+import images
+import log_reader
+import app_logging
+import metrics
+import query_profiler
+import search
+import live
+import paging
 from enc import hash_password as encrypt
 import datetime
 from datetime import datetime, timedelta
 import secrets
-from shapely.geometry import Point, Polygon
+from shapely.geometry import Polygon
 from fileinput import filename
-from PIL import Image
 import logging
-import smtplib
 import random
+import time
+import hashlib
+import bisect
+import math
 import os
 from dotenv import load_dotenv
 import colorama
-from flask import Flask, request, render_template, redirect, url_for, session, make_response,send_from_directory
+from flask import Flask, request, render_template, redirect, url_for, session, make_response,send_from_directory, jsonify, Response, stream_with_context
 
-logger = logging.getLogger('my_logger')
-logger.setLevel(logging.INFO)
+logger = app_logging.setup() # 'my_logger', file writes happen on a background thread
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-
-f = logging.FileHandler('app.log')
-c = logging.StreamHandler()
-f.setLevel(logging.INFO)
-f.setFormatter(formatter)
-c.setLevel(logging.INFO)
-c.setFormatter(formatter)
-
-logger.addHandler(c)
-logger.addHandler(f)
+LOG_LEVELS = ["INFO", "WARNING", "ERROR"]
+LOG_PAGE_SIZE = 100 # log lines per page on the admin logs page
 
 
 logger.info("App initializing")
 app = Flask(__name__)
 app.secret_key = 'user_id'
+app.jinja_env.globals['rendition'] = images.rendition # smaller avatar files for the templates
+metrics.init_app(app) # latency and DB calls per endpoint, see /metrics
+query_profiler.start() # only records anything once switched on
 
 with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
     s.connect(("8.8.8.8", 80))
@@ -44,6 +53,10 @@ logger.info(f"IP Address: {my_ip}")
 
 load_dotenv()
 
+migrations.run_migrations() # brings DB.db up to the latest schema
+mailer.start() # sends anything left in the OUTBOX
+remember_me.start() # deletes expired remember me tokens every hour
+
 
 def check_login(Email, password, email_type):
     email_type = "SchoolEmail" if email_type == "school" else "HomeEmail"
@@ -55,25 +68,27 @@ def get_time_table(user_id):
     timeTableID = DB_interface.get_data("SELECT TimeTableID FROM STUDENT_INFO WHERE UserID = ?", (user_id,))[0][0]
     data = DB_interface.get_data("""
     SELECT 
-        TIMETABLE.Day,
-        TIMETABLE.Start,
-        TIMETABLE.End,
+        SET_LESSONS.Day,
+        SET_LESSONS.Start,
+        SET_LESSONS.End,
         SUBJECTS.Name,
         LOCATIONS.LocationName,
-        TIMETABLE.Week,
+        SET_LESSONS.Week,
         substr(ACCOUNTS.FirstName, 1, 1) || '. ' || ACCOUNTS.LastName
     FROM 
-        TIMETABLE
+        PUPIL_SETS
     JOIN 
-        SUBJECTS ON TIMETABLE.SubjectID = SUBJECTS.SubjectID
+        SET_LESSONS ON SET_LESSONS.SetID = PUPIL_SETS.SetID
     JOIN 
-        LOCATIONS ON TIMETABLE.LocationID = LOCATIONS.LocationID
+        SUBJECTS ON SET_LESSONS.SubjectID = SUBJECTS.SubjectID
+    JOIN 
+        LOCATIONS ON SET_LESSONS.LocationID = LOCATIONS.LocationID
     JOIN 
         ACCOUNTS ON SUBJECTS.UserID = ACCOUNTS.UserID
     WHERE 
-        TIMETABLE.TimeTableID = ?
+        PUPIL_SETS.TimeTableID = ?
     ORDER BY 
-        TIMETABLE.Week, TIMETABLE.Day, TIMETABLE.Start;
+        SET_LESSONS.Week, SET_LESSONS.Day, SET_LESSONS.Start;
 
         """, (timeTableID,))
     logger.info("Timetable goten")
@@ -100,10 +115,63 @@ def get_alteration(user_id):
     logger.info("Alterations goten")
     return alteration
 
-def get_combined_timetable(user_id):
+timetable_cache = LRUCache(max_entries=2000, max_bytes=32 * 1024 * 1024) # UserID -> (versions, merged timetable)
+
+def timetable_versions(user_id):
+    # (everyones timetables, the rooms, this users alterations), bumped by triggers (migration 9)
+    # so a change from any worker or an import shows up here, checked without building anything
+    versions = DB_interface.get_data("""
+        SELECT
+            (SELECT Version FROM DATA_VERSIONS WHERE Name = 'timetables'),
+            (SELECT Version FROM DATA_VERSIONS WHERE Name = 'locations'),
+            COALESCE((SELECT Version FROM TIMETABLE_VERSIONS WHERE UserID = ?), 0)
+        """, (user_id,))
+    return versions[0] if versions else None
+
+def invalidate_timetable(user_id=None):
+    # drops this processes copy now, the other workers see the version bump on their next read
+    if user_id is None:
+        timetable_cache.clear()
+    else:
+        timetable_cache.invalidate(user_id)
+    logger.info(f"Timetable cache invalidated for {user_id if user_id is not None else 'everyone'}")
+
+for stat in ("entries", "bytes", "hits", "misses", "evictions", "hit_rate"):
+    metrics.add_gauge(f"timetable_cache_{stat}", f"Timetable cache {stat.replace('_', ' ')}", lambda stat=stat: timetable_cache.stats()[stat])
+
+_locations = (None, []) # (locations version when read, [LocationName])
+
+def location_names(version=None):
+    # every room for the location dropdowns, re-read when the locations version moves on
+    global _locations
+    if version is None:
+        version = DB_interface.get_data("SELECT Version FROM DATA_VERSIONS WHERE Name = 'locations'")
+        version = version[0][0] if version else None
+    read_at, names = _locations
+    if version is None or version != read_at or not names:
+        names = [i[0] for i in DB_interface.get_data("SELECT LocationName FROM LOCATIONS")]
+        _locations = (version, names)
+    return names
+
+def get_combined_timetable(user_id, versions=None):
+    # versions has to be read before the timetable is, so a write in between makes the next read miss
+    versions = versions or timetable_versions(user_id)
+    cached = timetable_cache.get(user_id)
+    if cached is not None and versions is not None and cached[0] == versions:
+        logger.info("Timetable from cache")
+        return list(cached[1])
+    timetable = build_combined_timetable(user_id)
+    if versions is not None: # without the version table there is nothing to check a copy against
+        timetable_cache.put(user_id, (versions, timetable))
+    return list(timetable)
+
+def build_combined_timetable(user_id):
     timetable = get_time_table(user_id)
     alterations = get_alteration(user_id)
     logger.info("Timetable and alterations goten")
+    return merge_timetable(timetable, alterations)
+
+def merge_timetable(timetable, alterations):
     final_timetable = []
 
     for location, start, end, day, week, title in alterations:
@@ -130,7 +198,7 @@ def get_combined_timetable(user_id):
         final_timetable.append(entry)
     
     logger.info("Timetable and alterations combined")
-    return sorted(final_timetable, key=lambda x: (x[5], x[0], x[1]))
+    return tuple(sorted(final_timetable, key=lambda x: (x[5], x[0], x[1])))
 
 def update_current_location(user_id, location, update_type):
     locationID = DB_interface.get_data("SELECT LocationID FROM LOCATIONS WHERE LocationName = ?", (location,))
@@ -152,6 +220,8 @@ def update_current_location(user_id, location, update_type):
     else:
         logger.info("No existing alteration found, creating new one")
         DB_interface.execute_query("INSERT INTO ALTERATION (UserID, LocationID, Start, Day, Week, EventID, Title) VALUES (?, ?, ?, ?, ?, ?, ?)", (user_id, locationID, t, d, w, update_type, "Now"))
+    presence.record_location(user_id, locationID, update_type, location)
+    invalidate_timetable(user_id)
     
     logger.info("Location updated")
 
@@ -174,28 +244,14 @@ def update_password(user_id, current_password, new_password):
 
 def send_email_code(to_email, code):
     to_email = os.environ.get('email') # for testing
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(os.environ.get('email'), os.environ.get('app_password'))
-            message = f"Subject: Your MFA Code\n\nYour verification code is: {code}"
-            server.sendmail(os.environ.get('email'), to_email, message)
-        logger.info(f"Email sent to {to_email}")
-    except Exception as e:
-        logger.error(f"Email send error: {e}")
+    mailer.queue_email(to_email, "Your MFA Code", f"Your verification code is: {code}", priority=1) # ahead of mass emails
+    logger.info(f"Email queued for {to_email}")
 
 def send_mass_email(to_emails, subject, message_body):
     to_emails = [os.environ.get('email') for i in range(100)]  # for testing
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(os.environ.get('email'), os.environ.get('app_password'))
-            for i, to_email in enumerate(to_emails):
-                message = f"Subject: {subject}\n\n{message_body}\n\n\n\n\nThis is an automated message, please do not reply.\n{i}"
-                server.sendmail(os.environ.get('email'), to_email, message)
-                logger.info(f"Email sent to {to_email}")
-    except Exception as e:
-        logger.error(f"Email send error: {e}")
+    bodies = [f"{message_body}\n\n\n\n\nThis is an automated message, please do not reply.\n{i}" for i in range(len(to_emails))]
+    mailer.queue_emails(to_emails, subject, bodies)
+    logger.info(f"{len(to_emails)} emails queued")
 
 
 zone = {
@@ -293,6 +349,8 @@ zone = {
     ])
 }
 
+geofence = Geofence(zone) # spatial index over the zones, rebuild it if zone changes
+
 #web functions
 @app.route('/check_location', methods=['POST'])
 def check_location():
@@ -301,16 +359,57 @@ def check_location():
     lat = data.get('a')
     lon = data.get('o')
     logger.info(f"Coordinates received: lat={lat}, lon={lon}")
-    point = Point(lon, lat)
-    for location_name, polygon in zone.items():
-        if polygon.contains(point):
-            logger.info(f"Location found: {location_name}")
-            update_current_location(session['user_id'], location_name, "1") # 1 for automatic update
-            break
-    logger.info("Location not found")
+    location_name = geofence.locate(lon, lat)
+    if location_name:
+        logger.info(f"Location found: {location_name}")
+        record_fix(session['user_id'], location_name)
+    else:
+        logger.info("Location not found")
     return ''
 
 
+MAX_FIXES = 500 # per batch request
+
+def is_number(value):
+    # JSON numbers only, true/false are ints to python and NaN/Infinity get through json.loads
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def valid_fix(fix):
+    return isinstance(fix, dict) and is_number(fix.get('a')) and is_number(fix.get('o')) and is_number(fix.get('t', 0))
+
+@app.route('/check_location/batch', methods=['POST'])
+def check_location_batch():
+    data = request.get_json(silent=True)
+    fixes = data.get('fixes', []) if isinstance(data, dict) else data
+    if not isinstance(fixes, list) or not all(valid_fix(fix) for fix in fixes):
+        logger.warning("Bad location batch")
+        return jsonify(error="fixes must be a list of {a, o, t} numbers"), 400
+    logger.info(f"Location batch received: {len(fixes)} fixes")
+    if not fixes:
+        return jsonify(location=None, written=False)
+
+    fixes = sorted(fixes, key=lambda fix: fix.get('t', 0))[-MAX_FIXES:] # oldest first, keeping the newest
+    zones = geofence.classify([(fix['o'], fix['a']) for fix in fixes])
+    located = [name for name in zones if name]
+    if not located:
+        logger.info("Location not found")
+        return jsonify(location=None, written=False)
+
+    # only the latest zone matters, the row is overwritten anyway
+    location_name = located[-1]
+    written = record_fix(session['user_id'], location_name)
+    return jsonify(location=location_name, written=written)
+
+
+def record_fix(user_id, location_name):
+    # automatic update, skipped when the pupil is still in the zone the geofence last stored
+    if presence.last_location(user_id) == location_name:
+        logger.info(f"Still in {location_name}, no write")
+        return False
+    update_current_location(user_id, location_name, "1") # 1 for automatic update
+    return True
+
+
 @app.route('/update', methods=['GET', 'POST'])
 def update():
     if request.method == 'POST':
@@ -319,16 +418,14 @@ def update():
         update_current_location(session['user_id'], location, "2") # 2 for manual update
         logger.info("Location updated")
         return redirect(url_for('studentPage'))
-    return render_template('update.html', locations=[i[0] for i in DB_interface.get_data("SELECT LocationName FROM LOCATIONS")])
+    return render_template('update.html', locations=location_names())
 
 
 @app.route('/logout')
 def logout():
     token = request.cookies.get('rememberToken')
     if token:
-        DB_interface.execute_query(
-            "DELETE FROM REMEMBER_ME WHERE Token = ?", (token,)
-        )
+        remember_me.forget(token)
         logger.info("Remember me token deleted")
 
     #clear data
@@ -376,27 +473,17 @@ def change_password():
 def change_image():
     if request.method == 'POST':
         img = request.files['imageUpload']
-        f_name=encrypt(str(session['user_id'])) + ".png"
-        img.save("WEBPAGE/static/img/faces/" + f_name)
-        logger.info("file saved")
-
-        image = Image.open("WEBPAGE/static/img/faces/" + f_name)
-        logger.info("file opened")
-        image = image.convert("RGB")
-        logger.info("file converted")
-        image = image.crop((0, 0, min(image.size), min(image.size)))
-        logger.info("file cropped")
-        image = image.resize((150, 150))
-        logger.info("file resized")
-        image = image.rotate(-90, expand=True)
-        logger.info("file rotated")
-        image.save("WEBPAGE/static/img/faces/" + f_name, "PNG")
-        logger.info("file saved")
+        old_image = DB_interface.get_data("SELECT Image FROM ACCOUNTS WHERE UserID = ?", (session['user_id'],))
+        image_path = images.process_avatar(img)
+        logger.info(f"file processed {image_path}")
 
         DB_interface.execute_query(
             "UPDATE ACCOUNTS SET Image = ? WHERE UserID = ?",
-            (f"faces\\{f_name}", session['user_id'])
+            (image_path, session['user_id'])
         )
+        if old_image and old_image[0][0] and old_image[0][0] != image_path:
+            if not DB_interface.get_data("SELECT 1 FROM ACCOUNTS WHERE Image = ?", (old_image[0][0],)):
+                images.remove_avatar(old_image[0][0]) # nobody uses the old picture now
         return redirect(url_for('studentPage'))
     logger.info("change image page")
     return render_template('change_image.html')
@@ -412,27 +499,12 @@ def add_account():
         email = request.form['email']
         role = request.form['role']
         img = request.files['imageUpload']
-        f_name=encrypt(email) + ".png"
-        img.save("WEBPAGE/static/img/faces/" + f_name)
-        logger.info("file saved")
-
-        logger.info(f"file handling {f_name}")
-        image = Image.open("WEBPAGE/static/img/faces/" + f_name)
-        logger.info("file opened")
-        image = image.convert("RGB")
-        logger.info("file converted")
-        image = image.crop((0, 0, min(image.size), min(image.size)))
-        logger.info("file cropped")
-        image = image.resize((150, 150))
-        logger.info("file resized")
-        image = image.rotate(-90, expand=True)
-        logger.info("file rotated")
-        image.save("WEBPAGE/static/img/faces/" + f_name, "PNG")
-        logger.info("file saved")
+        image_path = images.process_avatar(img)
+        logger.info(f"file processed {image_path}")
 
         response = DB_interface.execute_query(
             "INSERT INTO ACCOUNTS (FirstName, LastName, Gender, SchoolEmail, RoleID, Image) VALUES (?, ?, ?, ?, ?, ?)",
-            (first_name, last_name, gender, email, role, f"faces\\{f_name}")
+            (first_name, last_name, gender, email, role, image_path)
         )
     if not response:
         logger.error("Account Failed to add successfully!")
@@ -456,23 +528,27 @@ def adminRemoveAccount():
         logger.info(f"Admin remove del_type {del_type}")
         if del_type == "True":
             image = DB_interface.get_data("select Image from accounts where schoolemail = ?", (email,))
-            if image and image[0][0]:
-                try:
-                    os.remove("WEBPAGE/static/" + image[0][0].replace("\\", "/"))
-                    logger.info(f"Image deleted: {image[0][0]}")
-                except Exception as e:
-                    logger.error(f"Error deleting image: {e}")
-                    print(f"Error deleting image: {e}")
-
-            response = DB_interface.execute_query(
-                "DELETE FROM ACCOUNTS WHERE SchoolEmail = ?;" \
-                "DELETE FROM STUDENT_INFO WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS);" \
-                "DELETE FROM TEACHER_INFO WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS);" \
-                "DELETE FROM TIMETABLE WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS);" \
-                "DELETE FROM ALTERATION WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS);" \
-                "DELETE FROM REMEMBER_ME WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS);",
-                (email,)
-            )
+            response = DB_interface.execute_query("DELETE FROM ACCOUNTS WHERE SchoolEmail = ?", (email,))
+            if response:
+                # sqlite runs one statement per execute, so the orphan clean up goes one at a time
+                for query in (
+                    "DELETE FROM STUDENT_INFO WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS)",
+                    "DELETE FROM TEACHER_INFO WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS)",
+                    "DELETE FROM PUPIL_SETS WHERE TimeTableID NOT IN (SELECT TimeTableID FROM STUDENT_INFO)",
+                    "DELETE FROM ALTERATION WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS)",
+                    "DELETE FROM REMEMBER_ME WHERE UserID NOT IN (SELECT UserID FROM ACCOUNTS)",
+                ):
+                    response = DB_interface.execute_query(query) and response
+                # avatars are shared by content hash, so only remove it once nobody else has it
+                if image and image[0][0] and not DB_interface.get_data("SELECT 1 FROM ACCOUNTS WHERE Image = ?", (image[0][0],)):
+                    try:
+                        images.remove_avatar(image[0][0])
+                        logger.info(f"Image deleted: {image[0][0]}")
+                    except Exception as e:
+                        logger.error(f"Error deleting image: {e}")
+                        print(f"Error deleting image: {e}")
+            invalidate_timetable() # alterations and timetables were removed
+            remember_me.clear_cache() # and so were their remember me tokens
             if response:
                 logger.info("Account deleted successfully completely")
                 return redirect(url_for('adminRemoveAccount'))
@@ -508,6 +584,22 @@ def adminSQLQuery():
     return render_template('sub/adminSQLQuery.html', response=None)
 
 
+@app.route('/sub/adminSlowQueries', methods=['GET', 'POST'])
+def adminSlowQueries():
+    if request.method == 'POST':
+        if request.form.get('action') == 'clear':
+            query_profiler.clear()
+            logger.info("Query profile cleared")
+        else:
+            threshold = request.form.get('threshold', type=float)
+            query_profiler.set_enabled(request.form.get('enabled') == 'on', threshold)
+            logger.info(f"Query profiler {'on' if query_profiler.enabled else 'off'}, threshold {query_profiler.threshold_ms}ms")
+        return redirect(url_for('adminSlowQueries'))
+    logger.info("Admin slow queries page")
+    return render_template('sub/adminSlowQueries.html', enabled=query_profiler.enabled, threshold=query_profiler.threshold_ms,
+                           slow=query_profiler.slow_queries(), top=query_profiler.top_queries())
+
+
 @app.route('/edit_account/<int:user_id>', methods=['GET', 'POST'])
 def edit_account(user_id):
     if request.method == 'POST':
@@ -533,12 +625,17 @@ def edit_account(user_id):
             sql += f" Gender = '{gender}'"
         sql += f" WHERE UserID = {user_id}"
         DB_interface.execute_query(sql)
+        invalidate_timetable(user_id) # their role or name may be on a page that is cached
         logger.info("Account updated successfully sql: " + sql)
     return render_template('sub/adminEditAccount.html', user_id=user_id, account=DB_interface.get_data("SELECT FirstName, LastName, SchoolEmail, HomeEmail, RoleID, Gender FROM ACCOUNTS WHERE UserID = ?", (user_id,))[0])
 
-@app.route('/sub/adminViewAccounts', methods=['GET', 'POST'])
-def adminViewAccounts():
-    accounts = DB_interface.get_data("""
+ACCOUNT_PAGE = 100 # accounts per page on the admin accounts list
+ACCOUNT_KEYS = [("LastName", []), ("FirstName", []), ("UserID", [])]
+
+def account_page(after=None, limit=ACCOUNT_PAGE):
+    # one page of accounts in name order, returns (accounts, cursor for the next page)
+    after_sql, after_params, order_sql, order_params = paging.keyset(ACCOUNT_KEYS, paging.decode_cursor(after, len(ACCOUNT_KEYS)))
+    accounts = DB_interface.get_data(f"""
     SELECT
         FirstName,
         LastName,
@@ -550,29 +647,64 @@ def adminViewAccounts():
             WHEN Gender = 'f' THEN 'Female'
             ELSE 'Unknown'
         END AS Gender,
-        UserID
+        UserID,
+        {order_sql}
     FROM
         ACCOUNTS
     JOIN
         ROLES ON ACCOUNTS.RoleID = ROLES.RoleID
+    WHERE 1 {after_sql}
     ORDER BY
-        LastName,
-        FirstName
-    """)
+        {order_sql}
+    LIMIT ?
+    """, tuple(order_params + after_params + order_params + [limit + 1]))
+    return paging.page(accounts, limit, len(ACCOUNT_KEYS))
+
+@app.route('/sub/adminViewAccounts', methods=['GET', 'POST'])
+def adminViewAccounts():
+    accounts, next_cursor = account_page()
     logger.info("Admin view accounts page")
-    return render_template('sub/adminViewAccounts.html', accounts=accounts)
+    return render_template('sub/adminViewAccounts.html', accounts=accounts, next_cursor=next_cursor)
+
+
+@app.route('/api/accounts', methods=['GET'])
+def api_accounts():
+    try:
+        accounts, next_cursor = account_page(request.args.get("after"))
+    except ValueError:
+        return jsonify(error="bad cursor"), 400
+    return jsonify(
+        accounts=[dict(zip(("first_name", "last_name", "school_email", "home_email", "role", "gender", "user_id"), account)) for account in accounts],
+        html=render_template('sub/_accountRows.html', accounts=accounts),
+        next=next_cursor
+    )
 
 
 @app.route('/sub/adminViewLogs', methods=['GET'])
 def adminViewLogs():
-    with open('app.log', 'r') as log_file:
-        logs = log_file.readlines()
-        logs = [log.split(" - ") for log in logs]
-        logger.info("open log file")
+    # one page at a time from the end of the log, filtered here rather than in the browser
+    levels = request.args.getlist('level')
+    if set(levels) >= set(LOG_LEVELS):
+        levels = [] # every level ticked is the same as no filter, and keeps the fast page jumps
+    since = request.args.get('since') or None
+    until = request.args.get('until') or None
+    search = request.args.get('q') or None
+    size = min(max(request.args.get('size', LOG_PAGE_SIZE, type=int), 1), 1000)
+    page = max(request.args.get('page', 0, type=int), 0)
+    cursor = request.args.get('cursor') or None
+
+    try:
+        logs, next_cursor = log_reader.read_page('app.log', size, page, cursor, levels, since, until, search)
+    except (ValueError, OSError) as e: # bad cursor or the log was rotated away under us
+        logger.warning(f"Log read error: {e}")
+        logs, next_cursor = log_reader.read_page('app.log', size, 0, None, levels, since, until, search)
+    filtered = bool(levels or since or until or search)
+    pages = None if filtered else -(-log_reader.total_lines('app.log') // size) # only known without filters
 
-    
     logger.info("Admin view logs page")
-    return render_template('sub/adminViewLogs.html', logs=logs[::-1])
+    return render_template('sub/adminViewLogs.html', logs=logs, next_cursor=next_cursor, page=page, pages=pages,
+                           size=size, levels=levels or LOG_LEVELS, since=since or "", until=until or "", search=search or "",
+                           all_levels=LOG_LEVELS)
 
 
 @app.route('/sub/adminSendEmail', methods=['GET', 'POST'])
@@ -594,21 +726,36 @@ def adminSendEmail():
             emails = DB_interface.get_data(f"SELECT {emailType} FROM ACCOUNTS WHERE RoleID=0 AND {emailType} IS NOT NULL")
 
         send_mass_email([email[0] for email in emails if email[0]], subject, message_body)
-        logger.info("Mass email sent")
+        logger.info("Mass email queued")
         return render_template('sub/adminSendEmail.html')
     
     return render_template('sub/adminSendEmail.html')
 
 
+dashboard_cache = PeriodCache(max_entries=500, max_bytes=16 * 1024 * 1024, max_age=60) # teacher list and tiles results for this period
+
+def on_presence(event, data):
+    # a pupil moved, so any list or tiles page showing them is out of date
+    if event == "location":
+        dashboard_cache.invalidate_user(data["user_id"])
+
+presence.subscribe(on_presence)
+
+for stat in ("entries", "bytes", "hits", "misses", "evictions", "hit_rate"):
+    metrics.add_gauge(f"dashboard_cache_{stat}", f"Teacher dashboard cache {stat.replace('_', ' ')}", lambda stat=stat: dashboard_cache.stats()[stat])
+
+
 @app.route('/sub/teacherList', methods=['GET']) 
 def teacher_list():
     logger.info("Teacher list page")
-    now = datetime.now()
-    d = now.weekday()
-    t = now.strftime("%H:%M")
-    w = 1 if (now.isocalendar().week % 2) == 1 else 2
+    d, t, w = presence.now_slot()
+    key = presence.ensure_period(d, t, w)
 
-    logger.info("Teacher tiles data received")
+    people = dashboard_cache.get(key, ("list",))
+    if people is not None:
+        logger.info("Teacher list from cache")
+        return render_template('sub/teacherList.html', people=people, period=key)
+    started = time.monotonic()
 
     sql = """
         SELECT
@@ -616,85 +763,93 @@ def teacher_list():
             A.LastName,
             S.Name AS SubjectName,
             CASE
-                WHEN AL.LocationID IS NOT NULL AND AL.LocationID <> T.LocationID THEN 1
-                WHEN AL.LocationID IS NULL THEN 0
+                WHEN P.ActualLocationID IS NOT NULL AND P.ActualLocationID <> P.ExpectedLocationID THEN 1
+                WHEN P.ActualLocationID IS NULL THEN 0
                 ELSE 2
-            END AS Status
+            END AS Status,
+            A.UserID,
+            P.ExpectedLocationID
         FROM
-            ACCOUNTS A
-        JOIN
-            STUDENT_INFO SI ON A.UserID = SI.UserID
+            PRESENCE P
         JOIN
-            TIMETABLE T ON SI.TimeTableID = T.TimeTableID
+            ACCOUNTS A ON A.UserID = P.UserID
         JOIN
-            SUBJECTS S ON T.SubjectID = S.SubjectID
-        LEFT JOIN
-            ALTERATION AL ON AL.AlterationID = SI.AlterationID
-                AND AL.Day = T.Day
-                AND AL.Week = T.Week
-                AND AL.Start <= ?
-                AND AL.End >= ?
+            SUBJECTS S ON S.SubjectID = P.ExpectedSubjectID
         WHERE
-            (T.Start <= ?
-            AND T.End >= ?
-            AND T.Day = ?
-            AND T.Week = ?)
+            P.PeriodKey = ?
             AND A.RoleID = 0
     """
 
-    # test override
-    t = "08:35"
-    params = [t, t, t, t, d, w]
-
     logger.info(f"Executing SQL query")
-    people = DB_interface.get_data(sql, tuple(params))
+    people = DB_interface.get_data(sql, (key,))
     logger.info(f"Query returned {len(people)} results")
-    return render_template('sub/teacherList.html', people=people)
-
-
-@app.route('/sub/teacherTiles', methods=['GET'])
-def teacher_tiles():
-    now = datetime.now()
-    d = now.weekday()
-    t = now.strftime("%H:%M")
-    w = 1 if (now.isocalendar().week % 2) == 1 else 2
-
-    limit = request.args.get("limit", "50")
-    search_name = request.args.get("SearchName", "")
-    houses = request.args.getlist("house")
-    forms = request.args.getlist("form")
-    SearchRoom = request.args.get("SearchRoom", "*")
-    logger.info("Teacher tiles data received")
-
-    sql = """
+    dashboard_cache.put(key, ("list",), people, [person[4] for person in people], started)
+    return render_template('sub/teacherList.html', people=people, period=key)
+
+
+TILE_LIMITS = ("20", "50", "100", "1000") # tiles per page, the same choices as the limit dropdown
+
+def tile_page(args, after=None):
+    # one page of teacher tiles for the current period, returns (people, cursor for the next page)
+    d, t, w = presence.now_slot()
+    key = presence.ensure_period(d, t, w)
+
+    limit = args.get("limit", "50")
+    limit = int(limit) if limit in TILE_LIMITS else 50
+    search_name = args.get("SearchName", "")
+    houses = args.getlist("house")
+    forms = args.getlist("form")
+    SearchRoom = args.get("SearchRoom", "*")
+
+    # the same filters in any order share one entry
+    cache_key = ("tiles", limit, search_name, tuple(sorted(set(houses))), tuple(sorted(set(forms))), SearchRoom, after)
+    cached = dashboard_cache.get(key, cache_key)
+    if cached is not None:
+        logger.info("Teacher tiles from cache")
+        return cached
+    started = time.monotonic()
+
+    names = search.NameSearch(search_name)
+    keys = names.keys + [("ACCOUNTS.LastName", []), ("ACCOUNTS.FirstName", []), ("ACCOUNTS.UserID", [])]
+    after = paging.decode_cursor(after, len(keys))
+    after_sql, after_params, order_sql, order_params = paging.keyset(keys, after)
+
+    sql = f"""
         SELECT
             ACCOUNTS.Image,
             ACCOUNTS.FirstName,
             ACCOUNTS.LastName,
             STUDENT_INFO.House,
             STUDENT_INFO.Form,
-            SUBJECTS.Name
+            SUBJECTS.Name,
+            EXPECTED.LocationName,
+            ACTUAL.LocationName,
+            ACCOUNTS.UserID,
+            {order_sql}
         FROM
-            ACCOUNTS
+            PRESENCE
         JOIN
-            STUDENT_INFO ON ACCOUNTS.UserID = STUDENT_INFO.UserID
+            ACCOUNTS ON ACCOUNTS.UserID = PRESENCE.UserID
         JOIN
-            TIMETABLE ON STUDENT_INFO.TimeTableID = TIMETABLE.TimeTableID
+            STUDENT_INFO ON STUDENT_INFO.UserID = PRESENCE.UserID
         JOIN
-            SUBJECTS ON TIMETABLE.SubjectID = SUBJECTS.SubjectID
+            SUBJECTS ON SUBJECTS.SubjectID = PRESENCE.ExpectedSubjectID
         JOIN
-            LOCATIONS on TIMETABLE.LocationID = LOCATIONS.LocationID 
+            LOCATIONS EXPECTED ON EXPECTED.LocationID = PRESENCE.ExpectedLocationID
+        LEFT JOIN
+            LOCATIONS ACTUAL ON ACTUAL.LocationID = PRESENCE.ActualLocationID
+    """
+    params = list(order_params)
+    sql += names.join # trigram index for the name search, see search.py
+    params.extend(names.join_params)
+    sql += """
         WHERE
-            (TIMETABLE.Start <= ?
-            AND TIMETABLE.End >= ?
-            AND TIMETABLE.Day = ?
-            AND TIMETABLE.Week = ?)
+            PRESENCE.PeriodKey = ?
             AND RoleID = 0
-            AND (FirstName LIKE ? OR LastName LIKE ?)
     """
-    
-    t="08:35" # for testing
-    params = [t, t, d, w, f"%{search_name}%", f"%{search_name}%"]
+    params.append(key)
+    sql += names.where
+    params.extend(names.where_params)
 
     if houses:
         placeholders = ','.join(['?'] * len(houses))
@@ -705,23 +860,73 @@ def teacher_tiles():
         sql += f" AND STUDENT_INFO.Form IN ({placeholders})"
         params.extend(forms)
     if SearchRoom and SearchRoom != "*":
-        sql += f" AND LOCATIONS.locationName LIKE '%{SearchRoom}%'"
+        room_sql, room_params = search.room_filter(SearchRoom, "EXPECTED.LocationID", "EXPECTED.LocationName")
+        sql += room_sql
+        params.extend(room_params)
 
-    sql += " ORDER BY LastName, FirstName LIMIT ?"
-    params.append(limit)
+    sql += after_sql # starts after the last tile of the page before
+    params.extend(after_params)
+    sql += f" ORDER BY {order_sql} LIMIT ?"
+    params.extend(order_params)
+    params.append(limit + 1) # one extra to know if there is another page
 
     #DB and dealing with results
     logger.info(f"Executing SQL query")
     people = DB_interface.get_data(sql, tuple(params))
-
     logger.info(f"Query returned {len(people)} results")
-    return render_template('sub/teacherTiles.html', people=people)
+    result = paging.page(people, limit, len(keys))
+    dashboard_cache.put(key, cache_key, result, [person[8] for person in result[0]], started)
+    return result
+
+
+@app.route('/sub/teacherTiles', methods=['GET'])
+def teacher_tiles():
+    logger.info("Teacher tiles data received")
+    people, next_cursor = tile_page(request.args)
+    period = presence.period_key(*presence.now_slot())
+    return render_template('sub/teacherTiles.html', people=people, next_cursor=next_cursor, period=period)
+
+
+@app.route('/api/tiles', methods=['GET'])
+def api_tiles():
+    # the next page of tiles as JSON, for loading more as the teacher scrolls
+    try:
+        people, next_cursor = tile_page(request.args, request.args.get("after"))
+    except ValueError:
+        return jsonify(error="bad cursor"), 400
+    return jsonify(
+        people=[dict(zip(("image", "first_name", "last_name", "house", "form", "subject", "expected", "actual", "user_id"), person)) for person in people],
+        html=render_template('sub/_tileCards.html', people=people),
+        next=next_cursor
+    )
+
+
+@app.route('/stream/presence', methods=['GET'])
+def stream_presence():
+    # server-sent events for the tiles and list pages, see live.py
+    if 'user_id' not in session or account_type(session['user_id']) not in [1,2]:
+        return make_response("Not allowed", 403)
+    client = live.connect()
+    if client is None:
+        logger.warning("Too many presence streams open")
+        return make_response("Too many streams", 503)
+    logger.info("Presence stream opened")
+    return Response(stream_with_context(live.stream(client)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+metrics.add_gauge("presence_streams", "Open presence streams", live.clients)
 
 
 @app.route('/adminPage', methods=['GET', 'POST'])
 def adminPage():
     logger.info("Admin page")
-    return render_template('adminPage.html')
+    return render_template('adminPage.html', metrics=metrics.summary())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_page():
+    # Prometheus scrapes this
+    return make_response(metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
 
 
 @app.route('/teacherPage', methods=['GET', 'POST'])
@@ -733,42 +938,95 @@ def TeacherPage():
     return render_template('teacherPage.html')
 
 
+def current_lesson(timeTable, d, t, w):
+    # indexes of the entries before and after the one on now
+    if not timeTable: # nothing to point at, and 0 would be out of range
+        return None, None
+    last=0
+    next=0
+    for i, (day, start, end, subject, location, week, teacher) in enumerate(timeTable):
+        if (day == d) and (week == w) and (start <= t <= (end or '24:00')):
+            last = i - 1 if i - 1 >= 0 else None
+            next = i + 1 if i + 1 < len(timeTable) else None
+    return last, next
+
+STUDENT_PAGE_VERSION = str(os.path.getmtime(os.path.join(app.root_path, 'templates', 'studentPage.html'))) # a new template changes every ETag
+student_page_times = LRUCache(max_entries=5000, max_bytes=8 * 1024 * 1024) # UserID -> (versions, d, w, starts, ends) of their last page
+
+def page_etag(*parts):
+    # version token for everything a page is built from, same parts give the same tag
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+def lesson_times(timeTable, d, w):
+    # sorted starts and ends of the days lessons, the time only shows on the page through these
+    today = [entry for entry in timeTable if entry[0] == d and entry[5] == w]
+    return sorted(entry[1] for entry in today), sorted(entry[2] or '24:00' for entry in today)
+
+def student_page_etag(user_id, versions, d, t, w, starts, ends):
+    # which lessons are on now only changes when t passes a start or an end,
+    # so how many of each are behind t stands in for the time
+    position = (bisect.bisect_right(starts, t), bisect.bisect_left(ends, t))
+    return page_etag(STUDENT_PAGE_VERSION, user_id, versions, d, w, position)
+
+def not_modified(etag):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/studentPage', methods=['GET', 'POST'])
 def studentPage():
     if not session.get('user_id'):
         logger.info("No user logged in id, redirecting to logins")
         return redirect(url_for('login'))
-    if account_type(session['user_id']) in [1,2]:
+    user_id = session['user_id']
+
+    now = datetime.now()
+    d = now.weekday()
+    t = now.strftime("%H:%M")
+    w = 1 if (now.isocalendar().week % 2) == 1 else 2
+
+    # an unchanged page is answered from the version numbers alone, before any other queries.
+    # they are kept in the DB so a tag from any worker can be checked by any other
+    versions = timetable_versions(user_id)
+    if request.method == 'GET' and request.if_none_match and versions is not None:
+        last_page = student_page_times.get(user_id)
+        if last_page and last_page[:3] == (versions, d, w):
+            etag = student_page_etag(user_id, versions, d, t, w, *last_page[3:])
+            if etag in request.if_none_match:
+                logger.info("Student page not modified")
+                return not_modified(etag)
+
+    if account_type(user_id) in [1,2]:
         logger.info("redirecting to teacher page")
         return redirect(url_for('TeacherPage'))
 
     if request.method == 'POST':
         logger.info("Updating location")
         location = request.form['location']
-        update_current_location(session['user_id'], location, "2") # 2 for manual update
-
-    now = datetime.now()
-    d = now.weekday()
-    t = now.strftime("%H:%M")
-    w = 1 if (now.isocalendar().week % 2) == 1 else 2
+        update_current_location(user_id, location, "2") # 2 for manual update
+        versions = timetable_versions(user_id)
 
-    last=0
-    next=0
+    timeTable=get_combined_timetable(user_id, versions)
+    last, next = current_lesson(timeTable, d, t, w)
+    locations = location_names(versions[1] if versions else None)
 
-    timeTable=get_combined_timetable(session['user_id'])
-    for i, (day, start, end, subject, location, week, teacher) in enumerate(timeTable):
-        if (day == d) and (week == w) and (start <= t <= end if end else '24:00'):
-            last = i - 1 if i - 1 >= 0 else None
-            next = i + 1 if i + 1 < len(timeTable) else None
+    starts, ends = lesson_times(timeTable, d, w)
+    student_page_times.put(user_id, (versions, d, w, starts, ends))
+    etag = student_page_etag(user_id, versions, d, t, w, starts, ends) if versions is not None else None
+    if request.method == 'GET' and etag and etag in request.if_none_match:
+        logger.info("Student page not modified")
+        return not_modified(etag)
 
     lesson_loaction_cords = "ox27nn"
-    for area in zone:
-        if area in timeTable[next][4]:
-            data = zone[area]
-            center = data.centroid
-            lesson_loaction_cords = f"{center.y},{center.x}" # wrong way round on this
-
-    return render_template(
+    if next is not None: # nothing after the last lesson of the week
+        for area in zone:
+            if area in timeTable[next][4]:
+                data = zone[area]
+                center = data.centroid
+                lesson_loaction_cords = f"{center.y},{center.x}" # wrong way round on this
+
+    response = make_response(render_template(
         'studentPage.html',
         timeTable=timeTable,
         current_day=d,
@@ -776,9 +1034,13 @@ def studentPage():
         current_week=w,
         last=last,
         next=next,
-        locations=[i[0] for i in DB_interface.get_data("SELECT LocationName FROM LOCATIONS")],
+        locations=locations,
         lesson_location=lesson_loaction_cords
-    )
+    ))
+    if etag: # no versions to check a tag against means no tag
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # the browser has to ask every time, but a 304 is tiny
+    return response
 
 
 @app.route('/multi_factor_auth', methods=['GET', 'POST'])
@@ -806,21 +1068,13 @@ def mfa():
 
 @app.route('/login', methods=['GET', 'POST']) 
 def login():
-    # remove old
-    DB_interface.execute_query(
-        "DELETE FROM REMEMBER_ME WHERE ExpiryDate <= CURRENT_TIMESTAMP"
-    )
-    logger.info("remember me tokens deleted")
-
+    # expired tokens are deleted by remember_me's sweeper, so this is read only
     token = request.cookies.get('rememberToken')
     if token:
-        user = DB_interface.get_data(
-            "SELECT UserID FROM REMEMBER_ME WHERE Token = ? AND ExpiryDate > CURRENT_TIMESTAMP",
-            (token,)
-        )
-        if user:
+        user_id = remember_me.user_for(token)
+        if user_id is not None:
             logger.info(f"User logged in with remember me")
-            session['user_id'] = user[0][0]
+            session['user_id'] = user_id
             return make_response(redirect(url_for('studentPage')))
 
     # check for cookie token
@@ -829,7 +1083,7 @@ def login():
         # get inputs button
         emailType = request.form['emailType']
         email = request.form["email"]
-        remember_me = request.form.get('rememberMe', 'off') == 'on'
+        remember = request.form.get('rememberMe', 'off') == 'on'
         enc = encrypt(request.form['password'])
         user_id = check_login(email, enc, emailType)
 
@@ -855,16 +1109,11 @@ def login():
                 resp = make_response(redirect(url_for('studentPage')))
 
             # handle Remember Me
-            if remember_me:
-                token = secrets.token_hex(32)
-                expires = datetime.now() + timedelta(days=30)
-
-                DB_interface.execute_query(
-                    "INSERT INTO REMEMBER_ME (UserID, Token, ExpiryDate) VALUES (?, ?, ?)",
-                    (user_id, token, expires)
-                )
-                resp.set_cookie('rememberToken', token, max_age=60*60*24*30)
-                logger.info(f"rememberToken cookie set: {token}")
+            if remember:
+                token = remember_me.create(user_id)
+                if token:
+                    resp.set_cookie('rememberToken', token, max_age=remember_me.LIFETIME)
+                    logger.info(f"rememberToken cookie set: {token}")
 
             return resp
         else:
@@ -881,6 +1130,17 @@ def redirect_to_login():
     return redirect("/login")
 
 
+@app.route('/img/<path:filename>')
+def avatar(filename):
+    # avatars are named by their content hash, so browsers can keep them forever
+    folder = os.path.join(app.root_path, 'static', 'img')
+    if images.is_immutable(filename):
+        resp = send_from_directory(folder, filename, max_age=31536000, etag=images.etag_for(filename))
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return resp
+    return send_from_directory(folder, filename, max_age=300)
+
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(os.path.join(app.root_path, 'static'),'img/favicon.ico', mimetype='image/x-icon')
@@ -0,0 +1,175 @@
+import time
+import threading
+from flask import request
+import DB_interface
+
+# request latency and DB calls per endpoint, kept in memory and shown at /metrics
+# in the Prometheus text format and as a table on the admin page
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10) # seconds
+DB_CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200) # DB_interface calls per request
+
+_lock = threading.Lock()
+_request = threading.local() # the request this thread is handling, for the DB observer
+_gauges = {} # name -> (help, fn returning a number)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (le, count) pairs the way Prometheus wants them
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        # estimated from the buckets, linear inside the bucket it lands in
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if total + count >= rank:
+                return lower + (bound - lower) * ((rank - total) / count if count else 0)
+            total += count
+            lower = bound
+        return self.buckets[-1] # above the last bucket
+
+
+_latency = {} # (endpoint, method, status) -> Histogram of seconds
+_db_calls = {} # endpoint -> Histogram of calls per request
+_db_time = {} # endpoint -> Histogram of seconds in DB_interface per request
+_db_totals = {} # kind -> [calls, seconds], every call including ones outside a request
+
+
+def init_app(app):
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_teardown)
+    DB_interface.add_observer(_db_observer)
+
+def add_gauge(name, help, fn):
+    _gauges[name] = (help, fn)
+
+def _start():
+    _request.started = time.perf_counter()
+    _request.db_calls = 0
+    _request.db_time = 0.0
+    _request.recorded = False
+
+def _finish(response):
+    _record(response.status_code)
+    return response
+
+def _teardown(error):
+    if error is not None:
+        _record(500) # unhandled exception, after_request never ran
+
+def _record(status):
+    started = getattr(_request, "started", None)
+    if started is None or _request.recorded:
+        return
+    _request.recorded = True
+    seconds = time.perf_counter() - started
+    endpoint = request.endpoint or "unmatched" # 404s all share one series
+    with _lock:
+        key = (endpoint, request.method, str(status))
+        if key not in _latency:
+            _latency[key] = Histogram(LATENCY_BUCKETS)
+        _latency[key].observe(seconds)
+        if endpoint not in _db_calls:
+            _db_calls[endpoint] = Histogram(DB_CALL_BUCKETS)
+            _db_time[endpoint] = Histogram(LATENCY_BUCKETS)
+        _db_calls[endpoint].observe(_request.db_calls)
+        _db_time[endpoint].observe(_request.db_time)
+    _request.started = None
+
+def _db_observer(kind, query, params, seconds, rows):
+    if getattr(_request, "started", None) is not None:
+        _request.db_calls += 1
+        _request.db_time += seconds
+    with _lock:
+        totals = _db_totals.setdefault(kind, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels.items()) + "}"
+
+def _histogram_lines(name, help, series):
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} histogram"]
+    for labels, histogram in series:
+        for bound, total in histogram.cumulative():
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {total}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+def render():
+    # everything in the Prometheus text exposition format
+    with _lock:
+        lines = _histogram_lines(
+            "http_request_duration_seconds", "Request latency by endpoint, method and status",
+            [({"endpoint": e, "method": m, "status": s}, h) for (e, m, s), h in sorted(_latency.items())]
+        )
+        lines += _histogram_lines(
+            "db_calls_per_request", "DB_interface calls made by one request",
+            [({"endpoint": e}, h) for e, h in sorted(_db_calls.items())]
+        )
+        lines += _histogram_lines(
+            "db_seconds_per_request", "Time one request spent in DB_interface",
+            [({"endpoint": e}, h) for e, h in sorted(_db_time.items())]
+        )
+        lines += ["# HELP db_calls_total DB_interface calls by kind", "# TYPE db_calls_total counter"]
+        lines += [f"db_calls_total{_labels(kind=k)} {calls}" for k, (calls, seconds) in sorted(_db_totals.items())]
+        lines += ["# HELP db_seconds_total Time spent in DB_interface by kind", "# TYPE db_seconds_total counter"]
+        lines += [f"db_seconds_total{_labels(kind=k)} {seconds}" for k, (calls, seconds) in sorted(_db_totals.items())]
+    for name, (help, fn) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {fn()}"]
+    return "\n".join(lines) + "\n"
+
+def summary():
+    # one row per endpoint for the admin page, slowest p95 first
+    with _lock:
+        by_endpoint = {}
+        for (endpoint, method, status), histogram in _latency.items():
+            merged = by_endpoint.setdefault(endpoint, {"latency": Histogram(LATENCY_BUCKETS), "errors": 0})
+            for i, count in enumerate(histogram.counts):
+                merged["latency"].counts[i] += count
+            merged["latency"].sum += histogram.sum
+            merged["latency"].count += histogram.count
+            if status.startswith("5"):
+                merged["errors"] += histogram.count
+        rows = []
+        for endpoint, merged in by_endpoint.items():
+            latency = merged["latency"]
+            calls, db_time = _db_calls[endpoint], _db_time[endpoint]
+            rows.append({
+                "endpoint": endpoint,
+                "requests": latency.count,
+                "errors": merged["errors"],
+                "mean_ms": latency.sum / latency.count * 1000,
+                "p50_ms": latency.quantile(0.5) * 1000,
+                "p95_ms": latency.quantile(0.95) * 1000,
+                "db_calls": calls.sum / calls.count if calls.count else 0,
+                "db_ms": db_time.sum / db_time.count * 1000 if db_time.count else 0,
+            })
+    return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
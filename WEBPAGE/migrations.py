@@ -0,0 +1,423 @@
+import sqlite3
+import logging
+import itertools
+import DB_interface
+
+logger = logging.getLogger('my_logger')
+
+# numbered migrations, applied in order and recorded in PRAGMA user_version
+# each one is (version, name, sql or function(conn))
+# never edit one that has shipped, add a new one instead
+MIGRATIONS = []
+
+def migration(version, name, step):
+    MIGRATIONS.append((version, name, step))
+
+
+migration(1, "base schema", """
+CREATE TABLE IF NOT EXISTS ROLES (
+    RoleID INTEGER NOT NULL UNIQUE,
+    RoleName TEXT NOT NULL UNIQUE,
+    PRIMARY KEY(RoleID)
+);
+
+CREATE TABLE IF NOT EXISTS SUBJECTS (
+    SubjectID INTEGER NOT NULL UNIQUE,
+    Name TEXT NOT NULL,
+    UserID INTEGER NOT NULL,
+    EventID INTEGER NOT NULL,
+    PRIMARY KEY(SubjectID AUTOINCREMENT)
+);
+
+CREATE TABLE IF NOT EXISTS ACCOUNTS (
+    UserID INTEGER NOT NULL UNIQUE,
+    FirstName TEXT NOT NULL,
+    LastName TEXT NOT NULL,
+    SchoolEmail TEXT NOT NULL UNIQUE,
+    HomeEmail TEXT UNIQUE,
+    Gender TEXT NOT NULL,
+    RoleID INTEGER NOT NULL,
+    Password TEXT,
+    Image TEXT,
+    PRIMARY KEY(UserID)
+);
+
+CREATE TABLE IF NOT EXISTS REMEMBER_ME (
+    Token TEXT PRIMARY KEY,
+    UserID INTEGER,
+    ExpiryDate TEXT,
+    FOREIGN KEY(UserID) REFERENCES ACCOUNTS(UserID)
+);
+
+CREATE TABLE IF NOT EXISTS EVENTS (
+    EventID INTEGER NOT NULL UNIQUE,
+    Type TEXT,
+    PRIMARY KEY(EventID AUTOINCREMENT)
+);
+
+CREATE TABLE IF NOT EXISTS LOCATIONS (
+    LocationID INTEGER NOT NULL UNIQUE,
+    LocationName TEXT NOT NULL,
+    PRIMARY KEY(LocationID AUTOINCREMENT)
+);
+
+CREATE TABLE IF NOT EXISTS STUDENT_INFO (
+    UserID INTEGER,
+    Form TEXT,
+    House TEXT,
+    TimeTableID INTEGER,
+    AlterationID INTEGER,
+    Year INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS TIMETABLE (
+    TimeTableID INTEGER,
+    LocationID INTEGER,
+    SubjectID INTEGER,
+    Start TEXT,
+    End TEXT,
+    Day INTEGER,
+    Week INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS ALTERATION (
+    AlterationID INTEGER PRIMARY KEY AUTOINCREMENT,
+    UserID INTEGER,
+    LocationID INTEGER,
+    Start TEXT,
+    End TEXT,
+    Day INTEGER,
+    Week INTEGER,
+    Title TEXT,
+    EventID INTEGER
+);
+
+INSERT OR IGNORE INTO ROLES (RoleID, RoleName) VALUES (0, 'Pupil');
+INSERT OR IGNORE INTO ROLES (RoleID, RoleName) VALUES (1, 'Teacher');
+INSERT OR IGNORE INTO ROLES (RoleID, RoleName) VALUES (2, 'Admin');
+
+-- only seed EVENTS on an empty table so existing ids are left alone
+INSERT INTO EVENTS (EventID, Type)
+    SELECT column1, column2 FROM (VALUES
+        (1, 'CurrentManual'), (2, 'CurrentAuto'), (3, 'Academic Lesson'), (4, 'Music Lesson'),
+        (5, 'Sport'), (6, 'Other'), (7, 'CCF'))
+    WHERE NOT EXISTS (SELECT 1 FROM EVENTS);
+""")
+
+
+migration(2, "indexes for the hot queries", """
+-- get_time_table and the teacher views: one pupil, one week/day, range on Start
+CREATE INDEX IF NOT EXISTS idx_timetable_lookup ON TIMETABLE (TimeTableID, Week, Day, Start);
+-- update_current_location and get_alteration
+CREATE INDEX IF NOT EXISTS idx_alteration_user_event ON ALTERATION (UserID, EventID);
+-- location name -> id on every location update
+CREATE INDEX IF NOT EXISTS idx_locations_name ON LOCATIONS (LocationName);
+-- STUDENT_INFO has no primary key
+CREATE INDEX IF NOT EXISTS idx_student_info_user ON STUDENT_INFO (UserID);
+CREATE INDEX IF NOT EXISTS idx_student_info_timetable ON STUDENT_INFO (TimeTableID);
+-- expiry sweep on /login
+CREATE INDEX IF NOT EXISTS idx_remember_me_expiry ON REMEMBER_ME (ExpiryDate);
+-- subject lookups in the timetable import
+CREATE INDEX IF NOT EXISTS idx_subjects_lookup ON SUBJECTS (Name, UserID, EventID);
+""")
+
+
+
+migration(3, "materialised presence", """
+-- one row per pupil: where they should be this period and where they were last seen
+CREATE TABLE IF NOT EXISTS PRESENCE (
+    UserID INTEGER PRIMARY KEY,
+    ExpectedLocationID INTEGER,
+    ExpectedSubjectID INTEGER,
+    PeriodKey TEXT,
+    ActualLocationID INTEGER,
+    Source TEXT,
+    LastSeen INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_presence_period ON PRESENCE (PeriodKey);
+
+-- start from the current location rows that already exist
+INSERT INTO PRESENCE (UserID, ActualLocationID, Source)
+    SELECT UserID, LocationID, CASE EventID WHEN 2 THEN 'manual' ELSE 'auto' END
+    FROM ALTERATION
+    WHERE EventID IN (1, 2)
+    ORDER BY AlterationID
+ON CONFLICT(UserID) DO UPDATE SET
+    ActualLocationID = excluded.ActualLocationID,
+    Source = excluded.Source;
+""")
+
+
+migration(4, "email outbox", """
+-- emails waiting to be sent by the mailer workers
+CREATE TABLE IF NOT EXISTS OUTBOX (
+    EmailID INTEGER PRIMARY KEY AUTOINCREMENT,
+    ToAddress TEXT NOT NULL,
+    Subject TEXT,
+    Body TEXT,
+    Priority INTEGER NOT NULL DEFAULT 0,
+    Status TEXT NOT NULL DEFAULT 'pending',
+    Attempts INTEGER NOT NULL DEFAULT 0,
+    NextAttempt INTEGER NOT NULL DEFAULT 0,
+    ClaimedBy TEXT,
+    ClaimedAt INTEGER,
+    LastError TEXT,
+    Created INTEGER,
+    SentAt INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_queue ON OUTBOX (Status, Priority DESC, NextAttempt, EmailID);
+CREATE INDEX IF NOT EXISTS idx_outbox_claim ON OUTBOX (ClaimedBy);
+""")
+
+migration(5, "trigram search over names and rooms", """
+CREATE VIRTUAL TABLE IF NOT EXISTS ACCOUNTS_FTS USING fts5(
+    FirstName, LastName, content='ACCOUNTS', content_rowid='UserID', tokenize='trigram'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS LOCATIONS_FTS USING fts5(
+    LocationName, content='LOCATIONS', content_rowid='LocationID', tokenize='trigram'
+);
+
+-- the FTS tables only hold the index, these keep it in step with the real tables
+CREATE TRIGGER IF NOT EXISTS accounts_fts_insert AFTER INSERT ON ACCOUNTS BEGIN
+    INSERT INTO ACCOUNTS_FTS (rowid, FirstName, LastName) VALUES (new.UserID, new.FirstName, new.LastName);
+END;
+CREATE TRIGGER IF NOT EXISTS accounts_fts_delete AFTER DELETE ON ACCOUNTS BEGIN
+    INSERT INTO ACCOUNTS_FTS (ACCOUNTS_FTS, rowid, FirstName, LastName) VALUES ('delete', old.UserID, old.FirstName, old.LastName);
+END;
+CREATE TRIGGER IF NOT EXISTS accounts_fts_update AFTER UPDATE OF UserID, FirstName, LastName ON ACCOUNTS BEGIN
+    INSERT INTO ACCOUNTS_FTS (ACCOUNTS_FTS, rowid, FirstName, LastName) VALUES ('delete', old.UserID, old.FirstName, old.LastName);
+    INSERT INTO ACCOUNTS_FTS (rowid, FirstName, LastName) VALUES (new.UserID, new.FirstName, new.LastName);
+END;
+
+CREATE TRIGGER IF NOT EXISTS locations_fts_insert AFTER INSERT ON LOCATIONS BEGIN
+    INSERT INTO LOCATIONS_FTS (rowid, LocationName) VALUES (new.LocationID, new.LocationName);
+END;
+CREATE TRIGGER IF NOT EXISTS locations_fts_delete AFTER DELETE ON LOCATIONS BEGIN
+    INSERT INTO LOCATIONS_FTS (LOCATIONS_FTS, rowid, LocationName) VALUES ('delete', old.LocationID, old.LocationName);
+END;
+CREATE TRIGGER IF NOT EXISTS locations_fts_update AFTER UPDATE OF LocationID, LocationName ON LOCATIONS BEGIN
+    INSERT INTO LOCATIONS_FTS (LOCATIONS_FTS, rowid, LocationName) VALUES ('delete', old.LocationID, old.LocationName);
+    INSERT INTO LOCATIONS_FTS (rowid, LocationName) VALUES (new.LocationID, new.LocationName);
+END;
+
+INSERT INTO ACCOUNTS_FTS (ACCOUNTS_FTS) VALUES ('rebuild');
+INSERT INTO LOCATIONS_FTS (LOCATIONS_FTS) VALUES ('rebuild');
+""")
+
+migration(6, "name order indexes for keyset paging", """
+CREATE INDEX IF NOT EXISTS idx_accounts_name_order ON ACCOUNTS (LastName, FirstName, UserID);
+CREATE INDEX IF NOT EXISTS idx_accounts_role_name_order ON ACCOUNTS (RoleID, LastName, FirstName, UserID);
+""")
+
+def normalise_timetable(conn):
+    # TIMETABLE had every lesson copied out for every pupil in the set, this keeps each set's lessons
+    # once in SET_LESSONS and who is in it in PUPIL_SETS. TIMETABLE stays as a view so old queries still work
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SET_LESSONS (
+            SetLessonID INTEGER PRIMARY KEY AUTOINCREMENT,
+            SetID INTEGER NOT NULL,
+            SetCode TEXT,
+            LocationID INTEGER,
+            SubjectID INTEGER,
+            Start TEXT,
+            End TEXT,
+            Day INTEGER,
+            Week INTEGER
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS PUPIL_SETS (
+            TimeTableID INTEGER NOT NULL,
+            SetID INTEGER NOT NULL,
+            PRIMARY KEY (TimeTableID, SetID)
+        ) WITHOUT ROWID
+    """)
+
+    # the set codes never made it into the db, so a set is a subject plus the exact lessons a pupil has
+    # in it, that way every pupil gets back the same rows they had before
+    sets = {} # (SubjectID, lessons) -> SetID
+    members = []
+    rows = conn.execute("""
+        SELECT TimeTableID, SubjectID, LocationID, Start, End, Day, Week
+        FROM TIMETABLE
+        ORDER BY TimeTableID, SubjectID, Week, Day, Start, LocationID
+    """)
+    for (timetable_id, subject_id), lessons in itertools.groupby(rows, key=lambda row: (row[0], row[1])):
+        lessons = tuple(row[2:] for row in lessons)
+        key = (subject_id, lessons)
+        if key not in sets:
+            sets[key] = len(sets) + 1
+            conn.executemany(
+                "INSERT INTO SET_LESSONS (SetID, LocationID, SubjectID, Start, End, Day, Week) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(sets[key], location_id, subject_id, start, end, day, week) for location_id, start, end, day, week in lessons]
+            )
+        members.append((timetable_id, sets[key]))
+    conn.executemany("INSERT OR IGNORE INTO PUPIL_SETS (TimeTableID, SetID) VALUES (?, ?)", members)
+    logger.info(f"Timetable normalised into {len(sets)} sets for {len(members)} pupil sets")
+
+    conn.execute("DROP TABLE TIMETABLE")
+    for statement in split_sql("""
+        CREATE VIEW TIMETABLE AS
+            SELECT PUPIL_SETS.TimeTableID, SET_LESSONS.LocationID, SET_LESSONS.SubjectID,
+                   SET_LESSONS.Start, SET_LESSONS.End, SET_LESSONS.Day, SET_LESSONS.Week
+            FROM PUPIL_SETS
+            JOIN SET_LESSONS ON SET_LESSONS.SetID = PUPIL_SETS.SetID;
+        -- a pupils timetable
+        CREATE INDEX IF NOT EXISTS idx_set_lessons_set ON SET_LESSONS (SetID, Week, Day, Start);
+        -- the lesson slots of a day and everyone in a lesson now, for presence
+        CREATE INDEX IF NOT EXISTS idx_set_lessons_slot ON SET_LESSONS (Week, Day, Start, End);
+        CREATE INDEX IF NOT EXISTS idx_set_lessons_code ON SET_LESSONS (SetCode);
+        -- who is in a set
+        CREATE INDEX IF NOT EXISTS idx_pupil_sets_set ON PUPIL_SETS (SetID, TimeTableID);
+    """):
+        conn.execute(statement)
+
+migration(7, "timetable by set", normalise_timetable)
+
+migration(8, "remember me expiry as epoch seconds", """
+ALTER TABLE REMEMBER_ME ADD COLUMN ExpiresAt INTEGER;
+-- ExpiryDate was written as local time text, anything that wont parse counts as expired
+UPDATE REMEMBER_ME SET ExpiresAt = COALESCE(CAST(strftime('%s', ExpiryDate, 'utc') AS INTEGER), 0);
+DROP INDEX IF EXISTS idx_remember_me_expiry;
+-- the sweeper deletes by expiry, lookups go by Token which is the primary key
+CREATE INDEX IF NOT EXISTS idx_remember_me_expires ON REMEMBER_ME (ExpiresAt);
+""")
+
+
+migration(9, "version counters for cached timetables", """
+-- every worker keeps its own timetable cache, these counters are how they see each others writes
+-- and imports, a cached timetable is only used while the versions it was built at are current
+CREATE TABLE IF NOT EXISTS DATA_VERSIONS (
+    Name TEXT NOT NULL,
+    Version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(Name)
+);
+CREATE TABLE IF NOT EXISTS TIMETABLE_VERSIONS (
+    UserID INTEGER NOT NULL,
+    Version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(UserID)
+);
+INSERT OR IGNORE INTO DATA_VERSIONS (Name) VALUES ('timetables'), ('locations');
+CREATE TRIGGER IF NOT EXISTS set_lessons_version_insert AFTER INSERT ON SET_LESSONS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS set_lessons_version_update AFTER UPDATE ON SET_LESSONS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS set_lessons_version_delete AFTER DELETE ON SET_LESSONS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS pupil_sets_version_insert AFTER INSERT ON PUPIL_SETS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS pupil_sets_version_update AFTER UPDATE ON PUPIL_SETS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS pupil_sets_version_delete AFTER DELETE ON PUPIL_SETS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS subjects_version_insert AFTER INSERT ON SUBJECTS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS subjects_version_update AFTER UPDATE ON SUBJECTS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS subjects_version_delete AFTER DELETE ON SUBJECTS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS student_info_version_insert AFTER INSERT ON STUDENT_INFO BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS student_info_version_update AFTER UPDATE ON STUDENT_INFO BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS student_info_version_delete AFTER DELETE ON STUDENT_INFO BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+-- the teachers name is on every lesson they take
+CREATE TRIGGER IF NOT EXISTS accounts_version_update AFTER UPDATE OF FirstName, LastName ON ACCOUNTS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS accounts_version_delete AFTER DELETE ON ACCOUNTS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name = 'timetables';
+END;
+CREATE TRIGGER IF NOT EXISTS locations_version_insert AFTER INSERT ON LOCATIONS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name IN ('timetables', 'locations');
+END;
+CREATE TRIGGER IF NOT EXISTS locations_version_update AFTER UPDATE ON LOCATIONS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name IN ('timetables', 'locations');
+END;
+CREATE TRIGGER IF NOT EXISTS locations_version_delete AFTER DELETE ON LOCATIONS BEGIN
+    UPDATE DATA_VERSIONS SET Version = Version + 1 WHERE Name IN ('timetables', 'locations');
+END;
+-- alterations only change one pupils timetable
+CREATE TRIGGER IF NOT EXISTS alteration_version_insert AFTER INSERT ON ALTERATION BEGIN
+    INSERT INTO TIMETABLE_VERSIONS (UserID, Version) VALUES (new.UserID, 1)
+    ON CONFLICT(UserID) DO UPDATE SET Version = Version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS alteration_version_update AFTER UPDATE ON ALTERATION BEGIN
+    INSERT INTO TIMETABLE_VERSIONS (UserID, Version) VALUES (old.UserID, 1)
+    ON CONFLICT(UserID) DO UPDATE SET Version = Version + 1;
+    INSERT INTO TIMETABLE_VERSIONS (UserID, Version) VALUES (new.UserID, 1)
+    ON CONFLICT(UserID) DO UPDATE SET Version = Version + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS alteration_version_delete AFTER DELETE ON ALTERATION BEGIN
+    INSERT INTO TIMETABLE_VERSIONS (UserID, Version) VALUES (old.UserID, 1)
+    ON CONFLICT(UserID) DO UPDATE SET Version = Version + 1;
+END;
+""")
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply(conn, version, name, step):
+    conn.execute("BEGIN IMMEDIATE") # takes the write lock so two workers cant both migrate
+    try:
+        if current_version(conn) >= version: # another process got here first
+            conn.rollback()
+            return False
+        if callable(step):
+            step(conn)
+        else:
+            for statement in split_sql(step):
+                conn.execute(statement)
+        conn.execute(f"PRAGMA user_version = {int(version)}") # recorded in the same transaction
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+def split_sql(script):
+    # executescript would commit for us, so run the statements one by one instead
+    statements = []
+    current = ""
+    for line in script.splitlines():
+        if line.strip().startswith("--"):
+            continue
+        current += line + "\n"
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+def run_migrations():
+    conn = sqlite3.connect(DB_interface.db, isolation_level=None) # manual transactions
+    try:
+        version = current_version(conn)
+        for number, name, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if number <= version:
+                continue
+            if apply(conn, number, name, step):
+                logger.info(f"Migration {number} applied: {name}")
+            version = number
+        return version
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    print(f"DB at version {run_migrations()}")
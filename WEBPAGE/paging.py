@@ -0,0 +1,41 @@
+import json
+import base64
+
+# keyset pagination: each page starts after the sort key of the last row on the page before,
+# so page 100 costs the same as page 1 (no OFFSET for the DB to count through)
+
+
+def encode_cursor(values):
+    # opaque to the browser, just the sort key of the last row
+    data = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def decode_cursor(cursor, size):
+    # the sort key values, or None for the first page, ValueError if it isnt one of ours
+    if not cursor:
+        return None
+    values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("bad cursor")
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        raise ValueError("bad cursor")
+    return values
+
+def keyset(keys, after):
+    # keys is [(sql expression, params)] in ORDER BY order, all ascending and ending in something unique
+    # returns (where sql, where params, order by sql, order by params)
+    expressions = ", ".join(expression for expression, params in keys)
+    key_params = [param for expression, params in keys for param in params]
+    where, where_params = "", []
+    if after is not None:
+        where = f" AND ({expressions}) > ({', '.join('?' * len(keys))})"
+        where_params = key_params + list(after)
+    return where, where_params, expressions, key_params
+
+def page(rows, limit, key_columns):
+    # rows were fetched with limit + 1 so we know if there is another page,
+    # the sort key is the last key_columns of each row
+    more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1][-key_columns:]) if more and rows else None
+    return [row[:-key_columns] for row in rows], next_cursor
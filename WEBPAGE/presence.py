@@ -0,0 +1,146 @@
+import time
+import logging
+import threading
+from datetime import datetime
+import DB_interface
+
+logger = logging.getLogger('my_logger')
+
+TIME_OVERRIDE = "08:35" # for testing, None uses the real time
+
+SOURCES = {"1": "auto", "2": "manual"} # update_type -> PRESENCE.Source
+
+_slots = {} # (week, day) -> [(start, end), ...]
+_period_key = None # the period PRESENCE was last refreshed for
+_pending = {} # UserID -> (auto LocationName or None for manual, future) for PRESENCE writes not committed yet
+_pending_lock = threading.Lock()
+_listeners = [] # fn(event, data) told about every change to PRESENCE once it is committed
+_lock = threading.Lock()
+
+def subscribe(fn):
+    _listeners.append(fn)
+
+def unsubscribe(fn):
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+def publish(event, **data):
+    # listeners run on whichever thread made the change (often the DB writer) so must be quick
+    for fn in list(_listeners):
+        try:
+            fn(event, data)
+        except Exception:
+            logger.exception(f"Presence listener failed on {event}")
+
+def now_slot():
+    # (day, time, week) in the same form SET_LESSONS uses
+    now = datetime.now()
+    d = now.weekday()
+    t = TIME_OVERRIDE or now.strftime("%H:%M")
+    w = 1 if (now.isocalendar().week % 2) == 1 else 2
+    return d, t, w
+
+def day_slots(d, w):
+    if (w, d) not in _slots:
+        _slots[(w, d)] = DB_interface.get_data(
+            "SELECT DISTINCT Start, End FROM SET_LESSONS WHERE Week = ? AND Day = ? ORDER BY Start",
+            (w, d)
+        )
+    return _slots[(w, d)]
+
+def current_period(d, t, w):
+    # the (start, end) of the lesson slot t falls in, or None between lessons
+    for start, end in day_slots(d, w):
+        if start <= t <= end:
+            return start, end
+    return None
+
+def period_key(d, t, w):
+    period = current_period(d, t, w)
+    return f"{w}:{d}:{period[0]}" if period else None
+
+def ensure_period(d, t, w):
+    # refreshes the expected columns the first time we see a new period, returns its key
+    global _period_key
+    key = period_key(d, t, w)
+    if key is None or key == _period_key:
+        return key
+    with _lock:
+        if key != _period_key:
+            refresh_expected(key, d, t, w)
+            _period_key = key
+    return key
+
+def refresh_expected(key, d, t, w):
+    # where a pupil was seen only counts for the period it was seen in, so moving to a new period
+    # clears it and their next fix fills it in again
+    DB_interface.execute_query("""
+        INSERT INTO PRESENCE (UserID, ExpectedLocationID, ExpectedSubjectID, PeriodKey)
+        SELECT
+            STUDENT_INFO.UserID,
+            SET_LESSONS.LocationID,
+            SET_LESSONS.SubjectID,
+            ?
+        FROM
+            SET_LESSONS
+        JOIN
+            PUPIL_SETS ON PUPIL_SETS.SetID = SET_LESSONS.SetID
+        JOIN
+            STUDENT_INFO ON STUDENT_INFO.TimeTableID = PUPIL_SETS.TimeTableID
+        WHERE
+            SET_LESSONS.Start <= ?
+            AND SET_LESSONS.End >= ?
+            AND SET_LESSONS.Day = ?
+            AND SET_LESSONS.Week = ?
+        ON CONFLICT(UserID) DO UPDATE SET
+            ExpectedLocationID = excluded.ExpectedLocationID,
+            ExpectedSubjectID = excluded.ExpectedSubjectID,
+            ActualLocationID = CASE WHEN PRESENCE.PeriodKey IS excluded.PeriodKey THEN PRESENCE.ActualLocationID END,
+            Source = CASE WHEN PRESENCE.PeriodKey IS excluded.PeriodKey THEN PRESENCE.Source END,
+            PeriodKey = excluded.PeriodKey
+    """, (key, t, t, d, w))
+    logger.info(f"Presence refreshed for period {key}")
+    publish("period", key=key)
+
+def record_location(user_id, location_id, update_type, location_name=None):
+    # called from update_current_location so the teacher views never recompute it
+    # nothing waits on it, so it just joins the next group commit, listeners hear once its committed
+    source = SOURCES.get(str(update_type), "auto")
+    future = DB_interface.submit_query("""
+        INSERT INTO PRESENCE (UserID, ActualLocationID, Source, LastSeen) VALUES (?, ?, ?, ?)
+        ON CONFLICT(UserID) DO UPDATE SET
+            ActualLocationID = excluded.ActualLocationID,
+            Source = excluded.Source,
+            LastSeen = excluded.LastSeen
+    """, (user_id, location_id, source, int(time.time())))
+    with _pending_lock:
+        _pending[user_id] = (location_name if source == "auto" else None, future)
+    future.add_done_callback(lambda f: written(f, user_id, location_id, location_name))
+
+def written(future, user_id, location_id, location_name):
+    with _pending_lock:
+        if user_id in _pending and _pending[user_id][1] is future: # a newer write may have taken its place
+            del _pending[user_id]
+    if future.result():
+        publish("location", user_id=user_id, location_id=location_id, location_name=location_name)
+
+def last_location(user_id):
+    # the zone the geofence last stored for user_id this period, None if they set it by hand since,
+    # read from PRESENCE each time so every worker sees the others writes,
+    # a write of ours still waiting for the group commit counts as stored
+    with _pending_lock:
+        if user_id in _pending:
+            return _pending[user_id][0]
+    row = DB_interface.get_data("""
+        SELECT LOCATIONS.LocationName
+        FROM PRESENCE
+        JOIN LOCATIONS ON LOCATIONS.LocationID = PRESENCE.ActualLocationID
+        WHERE PRESENCE.UserID = ? AND PRESENCE.Source = 'auto'
+    """, (user_id,))
+    return row[0][0] if row else None
+
+def forget_slots():
+    # after a timetable import the lesson times may have changed
+    global _period_key
+    _slots.clear()
+    _period_key = None
@@ -0,0 +1,128 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import DB_interface
+
+# optional profiler for DB_interface: every query is grouped by its normalised SQL,
+# and queries slower than the threshold get their EXPLAIN QUERY PLAN saved with them
+
+enabled = os.environ.get('query_profiler', "0") == "1" # off unless asked for, or switched on from the admin page
+threshold_ms = float(os.environ.get('slow_query_ms', 50))
+SLOW_KEEP = 200 # slow queries kept, oldest dropped first
+PLAN_TTL = 300 # seconds before the same SQL is explained again
+
+_lock = threading.Lock()
+_stats = {} # normalised sql -> {"count", "total_ms", "max_ms", "rows", "shape"}
+_slow = deque(maxlen=SLOW_KEEP)
+_plans = {} # normalised sql -> (when, plan rows)
+_explainer = ThreadPoolExecutor(1, thread_name_prefix="explain") # plans are made off the request thread
+_local = threading.local()
+
+STRINGS = re.compile(r"'(?:[^']|'')*'")
+NUMBERS = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+SPACES = re.compile(r"\s+")
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+@lru_cache(maxsize=1024)
+def normalise(query):
+    # literals become ?, so the f-string queries still group together
+    query = STRINGS.sub("?", query)
+    query = NUMBERS.sub("?", query)
+    query = IN_LISTS.sub("IN (...)", query)
+    return SPACES.sub(" ", query).strip().rstrip(";")
+
+def params_shape(params):
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+
+def start():
+    DB_interface.add_observer(_observe)
+
+def set_enabled(on, threshold=None):
+    global enabled, threshold_ms
+    enabled = on
+    if threshold is not None:
+        threshold_ms = threshold
+
+def clear():
+    with _lock:
+        _stats.clear()
+        _slow.clear()
+        _plans.clear()
+
+def _observe(kind, query, params, seconds, rows):
+    if not enabled or getattr(_local, "busy", False):
+        return
+    _local.busy = True # nothing below may profile itself
+    try:
+        sql = normalise(query)
+        ms = seconds * 1000
+        shape = params_shape(params)
+        with _lock:
+            stat = _stats.setdefault(sql, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "shape": shape})
+            stat["count"] += 1
+            stat["total_ms"] += ms
+            stat["max_ms"] = max(stat["max_ms"], ms)
+            stat["rows"] += rows or 0
+            stat["shape"] = shape
+        if ms >= threshold_ms:
+            entry = {"when": time.strftime("%Y-%m-%d %H:%M:%S"), "kind": kind, "sql": sql, "shape": shape,
+                     "ms": ms, "rows": rows, "plan": None}
+            with _lock:
+                _slow.append(entry)
+                cached = _plans.get(sql)
+            if cached and time.time() - cached[0] < PLAN_TTL:
+                entry["plan"] = cached[1]
+            elif query.lstrip().upper().startswith(EXPLAINABLE):
+                _explainer.submit(_explain, entry, query, params)
+    finally:
+        _local.busy = False
+
+def _explain(entry, query, params):
+    # own read only connection, not DB_interface, so the plan never shows up in the profile
+    try:
+        conn = sqlite3.connect(f"file:{DB_interface.db}?mode=ro", uri=True)
+        try:
+            plan = [(row[0], row[1], row[3]) for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        plan = [(0, 0, f"could not explain: {e}")]
+    entry["plan"] = plan
+    with _lock:
+        _plans[entry["sql"]] = (time.time(), plan)
+
+
+def plan_text(plan):
+    # indents each step under its parent like the sqlite shell does
+    if not plan:
+        return ""
+    depth = {0: -1}
+    lines = []
+    for node, parent, detail in plan:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + detail)
+    return "\n".join(lines)
+
+def full_scans(plan):
+    # SCAN without an index is what gets slow as the school grows
+    return [detail for node, parent, detail in plan or [] if detail.startswith("SCAN") and "INDEX" not in detail]
+
+def slow_queries():
+    with _lock:
+        return [dict(entry, plan_text=plan_text(entry["plan"]), scans=full_scans(entry["plan"])) for entry in reversed(_slow)]
+
+def top_queries(n=50):
+    # by total time, the ones worth fixing first
+    with _lock:
+        rows = [dict(stat, sql=sql, mean_ms=stat["total_ms"] / stat["count"]) for sql, stat in _stats.items()]
+    return sorted(rows, key=lambda row: row["total_ms"], reverse=True)[:n]
@@ -0,0 +1,89 @@
+import time
+import secrets
+import logging
+import threading
+import DB_interface
+from cache import LRUCache
+
+logger = logging.getLogger('my_logger')
+
+# "remember me" login tokens. expired ones are swept in the background instead of on every /login,
+# and a token that checked out is trusted for CACHE_TTL so a cookie login is normally no DB work at all
+
+LIFETIME = 60 * 60 * 24 * 30 # seconds a token lasts, the same as the cookie
+SWEEP_EVERY = 60 * 60 # seconds between deletes of expired tokens
+CACHE_TTL = 60 # seconds a checked token is trusted, other workers only hear about a logout once this runs out
+
+_cache = LRUCache(max_entries=10000, max_bytes=4 * 1024 * 1024) # Token -> (UserID, checked at, ExpiresAt)
+_stop = threading.Event()
+_sweeper = None
+_start_lock = threading.Lock()
+
+
+def create(user_id):
+    # a new token for user_id, None if it couldnt be saved
+    token = secrets.token_hex(32)
+    expires = int(time.time()) + LIFETIME
+    if not DB_interface.execute_query(
+        "INSERT INTO REMEMBER_ME (UserID, Token, ExpiresAt) VALUES (?, ?, ?)",
+        (user_id, token, expires)
+    ):
+        return None
+    _cache.put(token, (user_id, int(time.time()), expires))
+    return token
+
+def user_for(token):
+    # the UserID a token belongs to, or None if it is unknown or expired
+    now = int(time.time())
+    cached = _cache.get(token)
+    if cached is not None:
+        user_id, checked, expires = cached
+        if now - checked < CACHE_TTL and now < expires:
+            return user_id
+    row = DB_interface.get_data("SELECT UserID, ExpiresAt FROM REMEMBER_ME WHERE Token = ? AND ExpiresAt > ?", (token, now))
+    if not row:
+        _cache.invalidate(token) # bad tokens are not cached, so guessing cant fill the cache
+        return None
+    _cache.put(token, (row[0][0], now, row[0][1]))
+    return row[0][0]
+
+def forget(token):
+    # on logout
+    _cache.invalidate(token)
+    DB_interface.execute_query("DELETE FROM REMEMBER_ME WHERE Token = ?", (token,))
+
+def clear_cache():
+    # after accounts are deleted, their tokens have gone from the DB
+    _cache.clear()
+
+def sweep():
+    future = DB_interface.submit_query("DELETE FROM REMEMBER_ME WHERE ExpiresAt <= ?", (int(time.time()),))
+    if future.result():
+        logger.info(f"Expired remember me tokens deleted: {getattr(future, 'rowcount', '?')}")
+
+def _sweep_loop():
+    while True:
+        try:
+            sweep()
+        except Exception:
+            logger.exception("Remember me sweep failed")
+        if _stop.wait(SWEEP_EVERY):
+            return
+
+def start():
+    # starts the sweeper thread once per process
+    global _sweeper
+    with _start_lock:
+        if _sweeper is not None:
+            return
+        _stop.clear()
+        _sweeper = threading.Thread(target=_sweep_loop, name="remember-me-sweeper", daemon=True)
+        _sweeper.start()
+
+def stop():
+    global _sweeper
+    with _start_lock:
+        if _sweeper is None:
+            return
+        _stop.set()
+        _sweeper = None
@@ -0,0 +1,50 @@
+# builds the WHERE parts for name and room searches. the whole term is matched anywhere in the
+# name like the old LIKE '%term%' did, terms of 3 or more letters go through the trigram FTS
+# tables (migration 5) as one phrase, shorter ones cant use a trigram so fall back to LIKE
+
+MIN_TRIGRAM = 3
+
+
+def phrase(term):
+    # one FTS5 string, so spaces, quotes and operators in the search are taken literally
+    return '"' + term.replace('"', '""') + '"'
+
+def like(term):
+    # LIKE pattern matching term anywhere, with % and _ taken literally
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def uses_trigram(term):
+    return len(term) >= MIN_TRIGRAM
+
+
+class NameSearch:
+    # the JOIN and WHERE parts for a name search with their params, and the sort keys
+    # that rank the matches, the term has to be in the first or last name
+    def __init__(self, term, user_id="ACCOUNTS.UserID", first="ACCOUNTS.FirstName", last="ACCOUNTS.LastName"):
+        self.join, self.join_params = "", []
+        self.where, self.where_params = "", []
+        self.keys = [] # [(sql expression, params)] to ORDER BY before the names
+        if not (term or "").strip():
+            return
+
+        if uses_trigram(term): # the FTS rank comes along with the match
+            self.join = f" JOIN (SELECT rowid AS UserID, rank AS NameRank FROM ACCOUNTS_FTS WHERE ACCOUNTS_FTS MATCH ?) NAME_MATCH ON NAME_MATCH.UserID = {user_id}"
+            self.join_params = [phrase(term)]
+        else:
+            self.where = f" AND ({first} LIKE ? ESCAPE '\\' OR {last} LIKE ? ESCAPE '\\')"
+            self.where_params = [like(term), like(term)]
+
+        # names starting with what was typed first, then the best FTS match
+        prefix = like(term)[1:]
+        self.keys.append((f"CASE WHEN {last} LIKE ? ESCAPE '\\' OR {first} LIKE ? ESCAPE '\\' THEN 0 ELSE 1 END", [prefix, prefix]))
+        if uses_trigram(term):
+            self.keys.append(("NAME_MATCH.NameRank", []))
+
+
+def room_filter(term, location_id="LOCATIONS.LocationID", name="LOCATIONS.LocationName"):
+    # (sql, params) to AND onto a query, the term has to be in the room name
+    if not (term or "").strip():
+        return "", []
+    if uses_trigram(term):
+        return f" AND {location_id} IN (SELECT rowid FROM LOCATIONS_FTS WHERE LOCATIONS_FTS MATCH ?)", [phrase(term)]
+    return f" AND {name} LIKE ? ESCAPE '\\'", [like(term)]
@@ -1,16 +1,34 @@
+let fixes = [];
+const batchSize = 10; // send once this many fixes are waiting
+const batchInterval = 30000; // or every 30s
+
 function success(pos) {
   cwd = pos.coords;
 
-  fetch("/check_location", {
+  fixes.push({
+    a: cwd.latitude,
+    o: cwd.longitude,
+    t: pos.timestamp,
+  });
+
+  if (fixes.length >= batchSize) {
+    sendFixes();
+  }
+}
+
+function sendFixes() {
+  if (fixes.length === 0) return;
+  const body = JSON.stringify({ fixes: fixes });
+  fixes = [];
+
+  fetch("/check_location/batch", {
     method: "POST",
     headers: {
       "Content-Type": "application/json",
     },
     credentials: "include",
-    body: JSON.stringify({
-      a: cwd.latitude,
-      o: cwd.longitude,
-    }),
+    keepalive: true, // still sent if the page is closing
+    body: body,
   })
 }
 
@@ -24,4 +42,9 @@ function getLocation() {
     timeout: 60000,
     });
 }
-getLocation();
\ No newline at end of file
+
+setInterval(sendFixes, batchInterval);
+document.addEventListener("visibilitychange", () => {
+  if (document.visibilityState === "hidden") sendFixes();
+});
+getLocation();
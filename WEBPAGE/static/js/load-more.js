@@ -0,0 +1,41 @@
+// loads the next page from one of the keyset paged /api/ endpoints when the
+// bottom of the list scrolls into view, the list keeps the cursor in data-next
+function loadMore(listId, sentinelId, url) {
+    const list = document.getElementById(listId);
+    const sentinel = document.getElementById(sentinelId);
+    let loading = false;
+
+    function nearBottom() {
+        return sentinel.getBoundingClientRect().top < window.innerHeight + 600;
+    }
+
+    async function next() {
+        const after = list.dataset.next;
+        if (!after || loading) return;
+        loading = true;
+        const params = new URLSearchParams(window.location.search); // same filters as the first page
+        params.set("after", after);
+        try {
+            const response = await fetch(url + "?" + params.toString());
+            if (!response.ok) throw new Error(response.status);
+            const page = await response.json();
+            list.insertAdjacentHTML("beforeend", page.html);
+            list.dataset.next = page.next || "";
+        } catch (e) {
+            console.log("Loading more failed", e); // tries again on the next scroll
+            loading = false;
+            return;
+        }
+        loading = false;
+        if (!list.dataset.next) {
+            observer.disconnect();
+        } else if (nearBottom()) {
+            next(); // a tall screen can still see the bottom
+        }
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) next();
+    }, { rootMargin: "600px" });
+    if (list.dataset.next) observer.observe(sentinel);
+}
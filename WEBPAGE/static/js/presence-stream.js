@@ -0,0 +1,18 @@
+// listens to /stream/presence and hands each pupil that moves to onLocation so the page can
+// patch just that pupil, anything bigger (a new period, missed events) reloads the page
+function watchPresence(onLocation) {
+    if (!window.EventSource) return;
+    const source = new EventSource("/stream/presence");
+    let opened = false;
+
+    source.addEventListener("open", () => {
+        if (opened) location.reload(); // reconnected, so changes may have been missed
+        opened = true;
+    });
+    source.addEventListener("location", event => onLocation(JSON.parse(event.data)));
+    source.addEventListener("period", event => {
+        const period = JSON.parse(event.data).key || "";
+        if (period !== document.body.dataset.period) location.reload();
+    });
+    source.addEventListener("reload", () => location.reload());
+}
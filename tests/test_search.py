@@ -0,0 +1,58 @@
+import sqlite3
+import pytest
+import search
+
+ROOMS = [
+    "Workblock Room 2", "Workblock Room 12", "Workblock Room 21", "Workblock Room 3",
+    "Humanity H", "Humanity F", "Humanity G", "Hut 2 Humanity", "Room 2 Workblock",
+    "Maths Fermat", "Music 1-05", "E7", "50% Room", "Quote \"Room\"",
+]
+NAMES = [("Amy", "Hart"), ("Harriet", "Smith"), ("Ann", "Marie Hart"), ("Jo", "Ha"), ("Mary", "Ann")]
+
+
+@pytest.fixture
+def db():
+    conn = sqlite3.connect(":memory:")
+    conn.executescript("""
+        CREATE TABLE LOCATIONS (LocationID INTEGER PRIMARY KEY, LocationName TEXT);
+        CREATE VIRTUAL TABLE LOCATIONS_FTS USING fts5(LocationName, content='LOCATIONS', content_rowid='LocationID', tokenize='trigram');
+        CREATE TABLE ACCOUNTS (UserID INTEGER PRIMARY KEY, FirstName TEXT, LastName TEXT);
+        CREATE VIRTUAL TABLE ACCOUNTS_FTS USING fts5(FirstName, LastName, content='ACCOUNTS', content_rowid='UserID', tokenize='trigram');
+    """)
+    conn.executemany("INSERT INTO LOCATIONS (LocationName) VALUES (?)", [(room,) for room in ROOMS])
+    conn.executemany("INSERT INTO ACCOUNTS (FirstName, LastName) VALUES (?, ?)", NAMES)
+    conn.execute("INSERT INTO LOCATIONS_FTS (LOCATIONS_FTS) VALUES ('rebuild')")
+    conn.execute("INSERT INTO ACCOUNTS_FTS (ACCOUNTS_FTS) VALUES ('rebuild')")
+    yield conn
+    conn.close()
+
+
+def rooms(db, term):
+    sql, params = search.room_filter(term)
+    return sorted(row[0] for row in db.execute("SELECT LocationName FROM LOCATIONS WHERE 1" + sql, params))
+
+def rooms_like(db, term):
+    # what the search did before the FTS tables, with no wildcards in the term
+    return sorted(row[0] for row in db.execute("SELECT LocationName FROM LOCATIONS WHERE instr(lower(LocationName), lower(?))", (term,)))
+
+
+@pytest.mark.parametrize("term", ["Workblock Room 2", "Humanity H", "Room 2", "room 1", "H", "E7", "2 Hu", "50%", "\"Room\"", "Fermat Maths"])
+def test_room_filter_matches_the_whole_term(db, term):
+    assert rooms(db, term) == rooms_like(db, term)
+
+def test_multi_word_room(db):
+    assert rooms(db, "Workblock Room 2") == ["Workblock Room 2", "Workblock Room 21"]
+    assert rooms(db, "Humanity H") == ["Humanity H"]
+
+def test_blank_room_search_is_no_filter():
+    assert search.room_filter("  ") == ("", [])
+
+
+@pytest.mark.parametrize("term", ["Hart", "Marie Hart", "Ann", "Ha", "Amy Hart", "ar"])
+def test_name_search_matches_the_whole_term(db, term):
+    names = search.NameSearch(term)
+    sql = "SELECT ACCOUNTS.UserID FROM ACCOUNTS" + names.join + " WHERE 1" + names.where
+    found = sorted(row[0] for row in db.execute(sql, names.join_params + names.where_params))
+    expected = sorted(row[0] for row in db.execute(
+        "SELECT UserID FROM ACCOUNTS WHERE instr(lower(FirstName), lower(?)) OR instr(lower(LastName), lower(?))", (term, term)))
+    assert found == expected
@@ -0,0 +1,54 @@
+import os
+import shutil
+import sqlite3
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    # main works on DB.db in the working directory, so give it a copy
+    folder = tmp_path_factory.mktemp("site")
+    shutil.copy(os.path.join(REPO, "DB.db"), folder / "DB.db")
+    cwd = os.getcwd()
+    os.chdir(folder)
+    import main
+    import DB_interface
+    main.app.config["TESTING"] = True
+    yield main
+    DB_interface.stop_writer()
+    os.chdir(cwd)
+
+def student(main):
+    return main.DB_interface.get_data("SELECT UserID FROM STUDENT_INFO LIMIT 1")[0][0]
+
+def get_page(main, user_id, etag=None):
+    client = main.app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+    return client.get("/studentPage", headers={"If-None-Match": etag} if etag else {})
+
+
+def test_current_lesson_with_no_timetable(app):
+    assert app.current_lesson([], 0, "10:00", 1) == (None, None)
+
+def test_student_page_with_no_timetable(app, monkeypatch):
+    monkeypatch.setattr(app, "get_combined_timetable", lambda user_id, versions=None: [])
+    assert get_page(app, student(app)).status_code == 200
+
+def test_etag_changes_after_a_write_from_another_worker(app):
+    user_id = student(app)
+    first = get_page(app, user_id)
+    etag = first.headers["ETag"]
+    assert get_page(app, user_id, etag).status_code == 304
+
+    other = sqlite3.connect("DB.db") # another worker, this process never hears about it
+    location = other.execute("SELECT LocationID FROM LOCATIONS LIMIT 1").fetchone()[0]
+    other.execute("INSERT INTO ALTERATION (UserID, LocationID, Start, Day, Week, EventID, Title) VALUES (?, ?, '10:00', 0, 1, 9, 'Moved')", (user_id, location))
+    other.commit()
+    other.close()
+
+    second = get_page(app, user_id, etag)
+    assert second.status_code == 200
+    assert second.headers["ETag"] != etag